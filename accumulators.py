@@ -0,0 +1,249 @@
+"""
+Streaming per-cohort accumulators behind the significance results.
+
+cohort_stats keeps, for every metric and every level of every cohort
+(survey answer, BMI/diet/antibiotic bucket, or a crossing of two of them),
+the count, mean and M2 (sum of squared deviations) of the samples in it.
+Those three numbers are mergeable (Chan et al.'s parallel form of
+Welford's update): two groups combine into the statistics of their union,
+and a group's statistics can be taken back out again. So when a load
+changes a few samples, update_accumulators() subtracts what those samples
+contributed before (kept per sample in cohort_members) and adds what they
+contribute now. An update costs O(changed samples) and leaves every other
+sample alone.
+
+The loaders call update_accumulators() after refreshing analysis_samples,
+with the sample_ids they changed when they know them. Without ids, every
+sample is compared in the database with what it contributed, and only the
+ones that differ are transferred and updated. group_stats() then answers from
+the accumulators without touching the per-sample tables. Its rows have
+the shape of sql_stats.group_stats(), so sql_stats.welch_ttest() takes
+them directly.
+
+Usage:
+    python accumulators.py              # catch up with analysis_samples
+    python accumulators.py --rebuild    # recompute everything from scratch
+"""
+import argparse
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from bulk_loader import upsert_frames
+from data_access import KEY_TAXA, SURVEY_COLUMNS, get_engine, is_embedded, query, read_frame
+
+# A cohort is an analysis_samples column, or a tuple of columns for a crossed cohort
+COHORTS = ['sex', 'country'] + SURVEY_COLUMNS + [
+    'bmi_group', 'diet_group', 'abx_group',
+    ('diet_type', 'vitamin_b_freq'),   # vegans by vitamin B (visualize_targeted_questions.py)
+    ('abx_group', 'probiotic_freq'),   # recent antibiotics by probiotics
+]
+# Metric -> SQL expression over analysis_samples; NULL = the sample does not count
+METRICS = {
+    **{taxon: taxon for taxon in KEY_TAXA},
+    # Ratios of 100+ (next to no Bacteroides) are left out, as in stats_new_targets.py
+    'pb_ratio': 'CASE WHEN pb_ratio < 100 THEN pb_ratio END',
+    # Diversity counts the samples with the full set of core metrics, the cohort the plots draw (WHERE has_metrics)
+    **{metric: f'CASE WHEN has_metrics THEN {metric} END' for metric in
+       ['shannon_entropy', 'phylogenetic_diversity', 'species_count', 'simpson', 'chao1']},
+}
+COLUMNS = list(dict.fromkeys(c for cohort in COHORTS for c in (cohort if isinstance(cohort, tuple) else [cohort])))
+KEY = ['cohort', 'level', 'metric']
+SEPARATOR = ' | '  # between the values of a crossed cohort's level
+
+
+def cohort_name(cohort):
+    return '+'.join(cohort) if isinstance(cohort, tuple) else cohort
+
+
+def batch_stats(rows):
+    """(n, mean, m2) per (cohort, level, metric) of a frame with the COLUMNS and METRICS columns."""
+    if rows.empty:
+        return pd.DataFrame({'n': [], 'mean': [], 'm2': []}, index=pd.MultiIndex.from_tuples([], names=KEY))
+    values = rows[list(METRICS)].astype('float64')
+    parts = []
+    for cohort in COHORTS:
+        columns = list(cohort) if isinstance(cohort, tuple) else [cohort]
+        level = rows[columns[0]].astype('string')
+        if len(columns) > 1:
+            level = level.str.cat([rows[c].astype('string') for c in columns[1:]], sep=SEPARATOR)
+        grouped = values.groupby(level.rename('level'))
+        n = grouped.count()
+        part = pd.DataFrame({
+            'n': n.stack(),
+            'mean': grouped.mean().stack(),
+            'm2': (grouped.var(ddof=0) * n).stack(),
+        })
+        part.index.names = ['level', 'metric']
+        parts.append(part[part['n'] > 0].assign(cohort=cohort_name(cohort)).reset_index())
+    return pd.concat(parts).set_index(KEY)[['n', 'mean', 'm2']]
+
+
+def combine(a, b, sign=1):
+    """
+    Chan et al.'s merge of two accumulator frames (n, mean, m2 by key):
+    the statistics of a's and b's samples together, or with sign=-1 those of
+    a's samples once b's (a subset of them) are taken out.
+    """
+    a, b = a.align(b, join='outer', fill_value=0)
+    n = a['n'] + sign * b['n']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if sign > 0:
+            delta = b['mean'] - a['mean']
+            mean = a['mean'] + delta * b['n'] / n
+            m2 = a['m2'] + b['m2'] + delta ** 2 * a['n'] * b['n'] / n
+        else:
+            mean = (a['n'] * a['mean'] - b['n'] * b['mean']) / n
+            m2 = a['m2'] - b['m2'] - (b['mean'] - mean) ** 2 * n * b['n'] / a['n']
+    touched = b['n'] > 0
+    empty = n <= 0
+    return pd.DataFrame({
+        'n': n.astype('int64'),
+        'mean': mean.where(touched, a['mean']).mask(empty, 0.0),
+        'm2': m2.clip(lower=0).where(touched, a['m2']).mask(empty, 0.0),  # rounding can leave -1e-12
+    })
+
+
+@contextmanager
+def _locked(engine):
+    """One update at a time (loaders may run in parallel); the embedded file has a single writer anyway."""
+    if is_embedded(engine):
+        yield
+        return
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(hashtext('cohort_stats'))")
+        conn.commit()
+        try:
+            yield
+        finally:
+            # Session-level lock: released explicitly, the pool would hand the connection on holding it
+            cur.execute("SELECT pg_advisory_unlock(hashtext('cohort_stats'))")
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def _changed_rows(engine, sample_ids, everything):
+    """
+    Old (cohort_members) and new (analysis_samples) values of the samples
+    whose values differ, or of all samples with everything=True. A sample that
+    left analysis_samples comes back with NULL new values.
+    """
+    values = COLUMNS + list(METRICS)
+    where = " WHERE sample_id IN (SELECT unnest(%(ids)s))" if sample_ids is not None else ""
+    current = ', '.join(COLUMNS + [f'CAST({expr} AS DOUBLE PRECISION) AS {name}' for name, expr in METRICS.items()])
+    differs = ' OR '.join(f'a.{c} IS DISTINCT FROM m.{c}' for c in values)
+    diff = read_frame(f"""
+        SELECT COALESCE(a.sample_id, m.sample_id) AS sample_id,
+               {', '.join(f'a.{c} AS new_{c}' for c in values)},
+               {', '.join(f'm.{c} AS old_{c}' for c in values)}
+        FROM (SELECT sample_id, {current} FROM analysis_samples{where}) a
+        FULL JOIN (SELECT * FROM cohort_members{where}) m ON m.sample_id = a.sample_id
+        {'' if everything else f'WHERE {differs}'}
+        """, engine, params={'ids': sample_ids} if sample_ids is not None else None)
+    old = diff[[f'old_{c}' for c in values]].set_axis(values, axis=1)
+    new = diff[['sample_id'] + [f'new_{c}' for c in values]].set_axis(['sample_id'] + values, axis=1)
+    return old, new
+
+
+def update_accumulators(engine=None, sample_ids=None, rebuild=False):
+    """
+    Brings cohort_stats up to date with analysis_samples: only the samples in
+    sample_ids (e.g. the ones a load just changed), or all of them by
+    default. rebuild=True recomputes every accumulator from scratch, which
+    also happens automatically while cohort_stats is empty.
+    """
+    engine = engine or get_engine()
+    start = time.perf_counter()
+    with _locked(engine):
+        current = read_frame("SELECT cohort, level, metric, n, mean, m2 FROM cohort_stats", engine).set_index(KEY)
+        if current.empty:
+            rebuild = True
+        if rebuild:
+            sample_ids = None
+        elif sample_ids is not None:
+            sample_ids = sorted(set(sample_ids))
+            if not sample_ids:
+                print("   -> cohort_stats: no samples changed")
+                return 0
+
+        old, new = _changed_rows(engine, sample_ids, everything=rebuild)
+        if new.empty:
+            print(f"   -> cohort_stats: up to date ({time.perf_counter() - start:.2f}s)")
+            return 0
+
+        added = batch_stats(new)
+        if rebuild:
+            # Every existing accumulator starts over from zero; levels no longer present end at n = 0
+            removed = batch_stats(old.iloc[:0])
+            base = current.assign(n=0, mean=0.0, m2=0.0)
+        else:
+            removed = batch_stats(old)
+            base = current
+        touched = added.index.union(removed.index)
+        if rebuild:
+            touched = touched.union(current.index)
+        base = base.reindex(touched, fill_value=0)
+        stats = combine(combine(base, removed, sign=-1), added).reset_index()
+
+        upsert_frames([(new, 'cohort_members', 'sample_id'), (stats, 'cohort_stats', KEY)], engine)
+    print(f"   -> cohort_stats: {len(new)} samples {'counted' if rebuild else 'changed'}, "
+          f"{len(stats)} accumulators updated in {time.perf_counter() - start:.2f}s")
+    return len(new)
+
+
+def _finish(stats, crossed=False):
+    """Indexes by level (a MultiIndex for crossed cohorts) and adds sum and sample variance."""
+    if crossed and not stats.empty:
+        stats.index = pd.MultiIndex.from_tuples([tuple(level.split(SEPARATOR)) for level in stats.index])
+    stats['sum'] = stats['n'] * stats['mean']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats['var'] = stats['m2'] / (stats['n'] - 1)
+    return stats[['n', 'sum', 'mean', 'var', 'm2']]
+
+
+def group_stats(cohort, metric, engine=None):
+    """
+    Current n, sum, mean and sample variance of `metric` per level of
+    `cohort`, straight from the accumulators (the result is cached until they change).
+    """
+    stats = query(
+        "SELECT level, n, mean, m2 FROM cohort_stats "
+        "WHERE cohort = %(cohort)s AND metric = %(metric)s AND n > 0 ORDER BY level",
+        engine, params={'cohort': cohort_name(cohort), 'metric': metric},
+    ).set_index('level')
+    return _finish(stats, crossed=isinstance(cohort, tuple))
+
+
+def pool(stats, mapping):
+    """
+    Merges the levels of group_stats() rows into groups, mapping {level: group}
+    (levels left out are dropped): the statistics the groups' samples would
+    have had if accumulated together.
+    """
+    groups = stats.index.map(mapping)
+    stats = stats[groups.notna()]
+    groups = pd.Series(groups[groups.notna()], index=stats.index, name='group')
+    n = stats['n'].groupby(groups).sum()
+    mean = (stats['n'] * stats['mean']).groupby(groups).sum() / n
+    between = stats['n'] * (stats['mean'] - mean.reindex(groups).to_numpy()) ** 2
+    m2 = stats['m2'].groupby(groups).sum() + between.groupby(groups).sum()
+    return _finish(pd.DataFrame({'n': n, 'mean': mean, 'm2': m2}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the per-cohort accumulators from analysis_samples.")
+    parser.add_argument('--rebuild', action='store_true', help="recompute every accumulator from scratch")
+    args = parser.parse_args()
+
+    print("--- Updating cohort accumulators ---")
+    update_accumulators(rebuild=args.rebuild)
+    print("--- Success! ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Alpha diversity computed directly from the BIOM count matrix.
+
+Replaces the externally produced rarefaction files for Shannon and observed
+features: every sample with at least DEPTH reads is rarefied to DEPTH reads,
+ITERATIONS times with independent seeded streams, and Shannon (base 2, as in
+the QIIME files), observed features, Simpson (1 - sum p^2) and bias-corrected
+Chao1 are averaged over the iterations. Iterations run in a process pool.
+
+Rarefaction draws reads without replacement (multivariate hypergeometric),
+the way QIIME rarefies, so a feature can never receive more reads than it
+has. The draw is sequential per feature - x_k ~ Hypergeometric(c_k, rest of
+the pool, reads still to draw) - and vectorized across all samples at once.
+
+Phylogenetic diversity needs the tree and still comes from PD_whole_tree.txt.
+
+Usage:
+    python alpha_diversity.py                         # DEPTH / ITERATIONS below
+    python alpha_diversity.py --depth 5000 --iterations 20
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from accumulators import update_accumulators
+from biom_stream import iter_sample_blocks
+from bulk_loader import refresh_views, upsert_frame
+from data_access import get_engine, read_frame
+
+# CONFIGURATION
+BIOM_PATH = 'data/ag-gg-100nt.biom'
+DEPTH = 10000      # Reads per sample after rarefaction (same depth as the lab metrics)
+ITERATIONS = 10    # Independent rarefactions averaged per sample
+SEED = 42          # Root seed; every iteration gets its own child stream
+
+METRICS = ['shannon_entropy', 'species_count', 'simpson', 'chao1']
+
+
+def rarefy(counts, depth, rng):
+    """
+    Subsamples every row of a samples x features CSR matrix (all rows with
+    at least `depth` reads) to exactly `depth` reads without replacement.
+    Returns the rarefied counts as an int64 array aligned with counts.data.
+    """
+    data = counts.data.astype(np.int64)
+    row_nnz = np.diff(counts.indptr)
+    n_rows = len(row_nnz)
+
+    # Process rows longest-first so the rows still active at position p are a prefix
+    order = np.argsort(-row_nnz, kind='stable')
+    starts = counts.indptr[:-1][order]
+    active_at = np.searchsorted(-row_nnz[order], -np.arange(row_nnz.max(initial=0)), side='left')
+
+    pool = np.asarray(counts.sum(axis=1)).ravel().astype(np.int64)[order]  # reads not yet considered
+    to_draw = np.full(n_rows, depth, dtype=np.int64)                       # reads still to pick
+    drawn = np.zeros_like(data)
+    for p, n_active in enumerate(active_at):
+        idx = starts[:n_active] + p
+        good = data[idx]
+        x = rng.hypergeometric(good, pool[:n_active] - good, to_draw[:n_active])
+        drawn[idx] = x
+        pool[:n_active] -= good
+        to_draw[:n_active] -= x
+    return drawn
+
+
+def diversity(counts, drawn, depth):
+    """The four metrics per row from the rarefied counts (vectorized over the non-zeros)."""
+    row_starts = counts.indptr[:-1]
+    p = drawn / depth
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plogp = np.where(drawn > 0, p * np.log2(p), 0.0)
+
+    shannon = -np.add.reduceat(plogp, row_starts)
+    observed = np.add.reduceat((drawn > 0).astype(np.int64), row_starts)
+    simpson = 1.0 - np.add.reduceat(p * p, row_starts)
+    singletons = np.add.reduceat((drawn == 1).astype(np.int64), row_starts)
+    doubletons = np.add.reduceat((drawn == 2).astype(np.int64), row_starts)
+    chao1 = observed + singletons * (singletons - 1) / (2.0 * (doubletons + 1))
+    return np.column_stack([shannon, observed, simpson, chao1])
+
+
+_counts = None
+
+
+def _init_worker(counts):
+    """Receives the count matrix once per worker instead of once per iteration."""
+    global _counts
+    _counts = counts
+
+
+def _one_iteration(depth, seed):
+    rng = np.random.default_rng(seed)
+    return diversity(_counts, rarefy(_counts, depth, rng), depth)
+
+
+def read_counts(path):
+    """(sample ids, samples x features CSR) from the BIOM file, read block by block."""
+    ids, blocks = [], []
+    for block_ids, block in iter_sample_blocks(path):
+        ids.append(block_ids)
+        blocks.append(block)
+    return np.concatenate(ids), sparse.vstack(blocks).tocsr()
+
+
+def alpha_diversity(counts, sample_ids, depth=DEPTH, iterations=ITERATIONS, seed=SEED, workers=None):
+    """
+    Mean of each metric over `iterations` rarefactions, one row per sample
+    that reached `depth` reads.
+    """
+    reads = np.asarray(counts.sum(axis=1)).ravel()
+    deep_enough = reads >= depth
+    counts = counts[deep_enough]
+
+    seeds = np.random.SeedSequence(seed).spawn(iterations)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(counts,)) as pool:
+        results = list(pool.map(_one_iteration, [depth] * iterations, seeds))
+
+    df = pd.DataFrame(np.mean(results, axis=0), columns=METRICS)
+    df.insert(0, 'sample_id', sample_ids[deep_enough])
+    return df, int((~deep_enough).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rarefy the BIOM table and load alpha diversity into gut_metrics.")
+    parser.add_argument('--depth', type=int, default=DEPTH, help="reads per sample after rarefaction")
+    parser.add_argument('--iterations', type=int, default=ITERATIONS, help="rarefactions averaged per sample")
+    parser.add_argument('--seed', type=int, default=SEED, help="root seed")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args()
+
+    print("--- Computing Alpha Diversity from the BIOM table ---")
+    print("1. Reading counts...")
+    sample_ids, counts = read_counts(BIOM_PATH)
+    print(f"   -> {counts.shape[0]} samples x {counts.shape[1]} features, {counts.nnz} non-zero counts")
+
+    print(f"2. Rarefying to {args.depth} reads, {args.iterations} iterations on {args.workers} workers...")
+    start = time.perf_counter()
+    df, too_shallow = alpha_diversity(counts, sample_ids, args.depth, args.iterations, args.seed, args.workers)
+    print(f"   -> {len(df)} samples in {time.perf_counter() - start:.1f}s "
+          f"({too_shallow} below {args.depth} reads skipped)")
+
+    print("3. Loading into gut_metrics...")
+    engine = get_engine()
+    # Only patients that made it into samples_coded (controls and quarantined rows stay out)
+    valid = read_frame("SELECT sample_id FROM samples_coded", engine)['sample_id']
+    df = df[df['sample_id'].isin(valid)]
+    upsert_frame(df, 'gut_metrics', engine)
+    refresh_views(engine)
+    update_accumulators(engine)
+    print("--- Success! Alpha diversity loaded. ---")
+
+
+if __name__ == "__main__":
+    main()
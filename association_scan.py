@@ -0,0 +1,191 @@
+"""
+Association scan: every lifestyle factor against every biomarker.
+
+Where stats_new_targets.py and the visualize_* scripts test a few hand-picked
+(factor, outcome) pairs, this screens each categorical column of `samples`
+(plus the bmi/diet/antibiotic buckets of analysis_samples) against each key
+genus and each gut_metrics metric, and controls the false discovery rate
+over the whole grid with Benjamini-Hochberg.
+
+Per factor the group one-hot matrix is built once. The per-group counts,
+sums, sums of squares and rank sums of ALL outcomes then come out of a few
+matrix products, so a factor costs the same whether it is tested against
+one outcome or against the whole outcome matrix. Two groups get Welch's
+t-test, more groups a one-way ANOVA; Kruskal-Wallis is reported alongside
+as the rank-based check. Levels with fewer than MIN_GROUP_SIZE values for
+an outcome, and 'Unspecified'-style answers, are left out of that test.
+
+Usage:
+    python association_scan.py                    # full grid, q < ALPHA highlighted
+    python association_scan.py --min-group-size 30 --top 40
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2, f, false_discovery_control, rankdata, t
+
+import data_access
+from validation import MISSING_VALUES
+
+# CONFIGURATION
+MIN_GROUP_SIZE = 10
+ALPHA = 0.05
+TOP = 20  # rows printed
+OUTPUT_PATH = 'results/association_scan.csv'
+
+FACTORS = ['sex', 'country'] + data_access.SURVEY_COLUMNS + ['bmi_group', 'diet_group', 'abx_group']
+METRICS = ['shannon_entropy', 'phylogenetic_diversity', 'species_count', 'simpson', 'chao1']
+OUTCOMES = data_access.KEY_TAXA + METRICS
+
+
+def group_sums(onehot, values):
+    """(counts, sums, sums of squares) per group (rows) and outcome (columns), NaN values left out."""
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    return onehot.T @ valid, onehot.T @ filled, onehot.T @ (filled * filled)
+
+
+def scan_factor(labels, names, Y, min_group_size=MIN_GROUP_SIZE):
+    """
+    All tests of one factor against every column of Y (samples x outcomes, NaN
+    = missing). labels are group codes per sample (-1 = not in the test).
+    Returns a dict of per-outcome arrays.
+    """
+    Y = Y[labels >= 0]
+    labels = labels[labels >= 0]
+    onehot = np.zeros((len(labels), len(names)))
+    onehot[np.arange(len(labels)), labels] = 1.0
+
+    # Groups too small for an outcome are dropped from that outcome's test
+    counts, _, _ = group_sums(onehot, Y)
+    active = counts >= min_group_size
+    Y = np.where(active[labels] & ~np.isnan(Y), Y, np.nan)
+    counts, sums, _ = group_sums(onehot, Y)
+    # Centering first keeps the sums of squares accurate for large counts (chao1, genera)
+    Y = Y - sums.sum(axis=0) / np.maximum(counts.sum(axis=0), 1)
+    counts, sums, squares = group_sums(onehot, Y)
+    active = counts >= min_group_size
+    k = active.sum(axis=0)
+    n = counts.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+        ss_within_g = squares - sums * means  # sum of (y - group mean)^2 per group
+        grand = sums.sum(axis=0) / n
+        ss_between = (counts * (means - grand) ** 2).sum(axis=0, where=active)
+        ss_within = ss_within_g.sum(axis=0, where=active)
+        eta_squared = ss_between / (ss_between + ss_within)
+
+        # One-way ANOVA (k > 2)
+        f_stat = (ss_between / (k - 1)) / (ss_within / (n - k))
+        anova_p = f.sf(f_stat, k - 1, n - k)
+
+        # Welch's t-test (k == 2): the first two active groups of each outcome
+        pair = np.argsort(~active, axis=0, kind='stable')[:2]
+        n_ab = np.take_along_axis(counts, pair, axis=0)
+        mean_ab = np.take_along_axis(means, pair, axis=0)
+        var_ab = np.take_along_axis(ss_within_g, pair, axis=0) / (n_ab - 1) / n_ab
+        se2 = var_ab.sum(axis=0)
+        t_stat = (mean_ab[0] - mean_ab[1]) / np.sqrt(se2)
+        df = se2 ** 2 / (var_ab ** 2 / (n_ab - 1)).sum(axis=0)
+        welch_p = 2 * t.sf(np.abs(t_stat), df)
+
+        # Kruskal-Wallis on ranks within each outcome; ties lower the sum of squared
+        # ranks by sum(t^3 - t) / 12, which gives the tie correction without a pass per outcome
+        ranks = rankdata(Y, axis=0, nan_policy='omit')
+        rank_counts, rank_sums, rank_squares = group_sums(onehot, ranks)
+        ties = 12 * (n * (n + 1) * (2 * n + 1) / 6 - rank_squares.sum(axis=0))
+        h = (12 / (n * (n + 1)) * (rank_sums ** 2 / rank_counts).sum(axis=0, where=active) - 3 * (n + 1))
+        h /= 1 - ties / (n ** 3 - n)
+        kruskal_p = chi2.sf(h, k - 1)
+
+    two = k == 2
+    tested = k >= 2
+    highest = np.where(active, means, -np.inf).argmax(axis=0)
+    return {
+        'test': np.where(two, 'welch_t', 'anova'),
+        'n': n.astype(int),
+        'n_groups': k,
+        'groups': [
+            ', '.join(f"{names[g]} ({int(counts[g, j])})" for g in np.flatnonzero(active[:, j]))
+            for j in range(Y.shape[1])
+        ],
+        'highest_group': [names[g] for g in highest],
+        'statistic': np.where(two, t_stat, f_stat),
+        'p_value': np.where(two, welch_p, anova_p),
+        'eta_squared': eta_squared,
+        'kruskal_h': h,
+        'kruskal_p': kruskal_p,
+        'tested': tested,
+    }
+
+
+def bh(p):
+    """Benjamini-Hochberg q-values; NaN p-values stay NaN and do not count as tests."""
+    q = np.full(len(p), np.nan)
+    finite = ~np.isnan(p)
+    if finite.any():
+        q[finite] = false_discovery_control(p[finite])
+    return q
+
+
+def scan(df, factors=FACTORS, outcomes=OUTCOMES, min_group_size=MIN_GROUP_SIZE):
+    """The full factor x outcome grid as one DataFrame, ranked by q-value."""
+    Y = df[outcomes].to_numpy(dtype=np.float64)
+    frames = []
+    for factor in factors:
+        values = df[factor].astype(object).where(~df[factor].isin(MISSING_VALUES))
+        labels, names = pd.factorize(values, sort=True)
+        result = scan_factor(labels, list(names), Y, min_group_size)
+        tested = result.pop('tested')
+        frames.append(pd.DataFrame({'factor': factor, 'outcome': outcomes, **result})[tested])
+
+    results = pd.concat(frames, ignore_index=True)
+    results['q_value'] = bh(results['p_value'].to_numpy())
+    results['kruskal_q'] = bh(results['kruskal_p'].to_numpy())
+    columns = ['factor', 'outcome', 'test', 'n', 'n_groups', 'groups', 'highest_group',
+               'statistic', 'p_value', 'q_value', 'eta_squared', 'kruskal_h', 'kruskal_p', 'kruskal_q']
+    return results[columns].sort_values(['q_value', 'p_value'], ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Screen every lifestyle factor against every biomarker, with FDR control.")
+    parser.add_argument('--min-group-size', type=int, default=MIN_GROUP_SIZE, help="smallest group kept in a test")
+    parser.add_argument('--alpha', type=float, default=ALPHA, help="q-value threshold")
+    parser.add_argument('--top', type=int, default=TOP, help="rows to print")
+    args = parser.parse_args()
+
+    print("--- Association Scan: lifestyle factors x biomarkers (Benjamini-Hochberg FDR) ---")
+
+    print("\n1. Fetching factors and outcomes...")
+    query = f"""
+    SELECT {', '.join(FACTORS + OUTCOMES)}
+    FROM analysis_samples
+    ORDER BY sample_id
+    """
+    df = data_access.query(query)
+    print(f"   -> {len(df)} samples, {len(FACTORS)} factors x {len(OUTCOMES)} outcomes")
+
+    print("\n2. Running the tests...")
+    start = time.perf_counter()
+    results = scan(df, min_group_size=args.min_group_size)
+    elapsed = time.perf_counter() - start
+    significant = results['q_value'] < args.alpha
+    print(f"   -> {len(results)} tests in {elapsed:.2f}s; {significant.sum()} with q < {args.alpha} "
+          f"({(results['kruskal_q'] < args.alpha).sum()} by Kruskal-Wallis)")
+
+    print(f"\n3. Top {args.top} associations:")
+    with pd.option_context('display.width', 200, 'display.max_colwidth', 40):
+        print(results.head(args.top)[['factor', 'outcome', 'test', 'n', 'highest_group',
+                                      'statistic', 'q_value', 'eta_squared', 'kruskal_q']].to_string(index=False))
+
+    os.makedirs('results', exist_ok=True)
+    results.to_csv(OUTPUT_PATH, index=False)
+    print(f"\nResults saved to '{OUTPUT_PATH}'")
+
+
+if __name__ == "__main__":
+    main()
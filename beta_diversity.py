@@ -0,0 +1,225 @@
+"""
+Between-sample (beta) diversity: Bray-Curtis and Jaccard distance matrices.
+
+The condensed upper triangle (n * (n - 1) / 2 float32 values, the layout of
+scipy.spatial.distance.squareform) is computed in square tiles of samples
+by a pool of worker processes, each writing its tile straight into a
+memory-mapped file under data/distances/. A 12k-sample matrix is ~290 MB on
+disk and never has to be held in memory. A manifest next to the file lists
+the finished tiles, so an interrupted run resumes where it stopped.
+
+Bray-Curtis is computed on relative abundances, sum|x - y| / (sum x + sum y),
+with sparse L1 distances; Jaccard on presence/absence, 1 - |A & B| / |A | B|,
+with a sparse product for the intersections.
+
+Usage:
+    python beta_diversity.py                                  # Bray-Curtis over genera
+    python beta_diversity.py --metric jaccard --source features
+    python beta_diversity.py --restart                        # ignore finished tiles
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.metrics.pairwise import manhattan_distances
+
+from biom_stream import iter_sample_blocks
+from etl_cache import file_fingerprint
+
+BIOM_PATH = 'data/ag-gg-100nt.biom'
+ABUNDANCE_PATH = 'data/taxon_abundance.csv'
+OUTPUT_DIR = os.path.join('data', 'distances')
+TILE_SIZE = 1000  # samples per tile side; a tile is TILE_SIZE^2 float64 while it is computed
+
+METRICS = ['braycurtis', 'jaccard']
+
+
+def load_matrix(source):
+    """
+    (sample ids, samples x taxa CSR counts, input file). source is 'features'
+    for the BIOM observations or a rank ('genus', 'family', ...) of taxon_abundance.csv.
+    """
+    if source == 'features':
+        ids, blocks = [], []
+        for block_ids, block in iter_sample_blocks(BIOM_PATH):
+            ids.append(block_ids)
+            blocks.append(block)
+        return np.concatenate(ids), sparse.vstack(blocks).tocsr(), BIOM_PATH
+
+    df = pd.read_csv(ABUNDANCE_PATH, usecols=['sample_id', 'rank', 'taxon', 'count'],
+                     dtype={'sample_id': str, 'rank': str, 'taxon': str, 'count': 'float32'})
+    df = df[df['rank'] == source]
+    if df.empty:
+        raise ValueError(f"No '{source}' rows in {ABUNDANCE_PATH}")
+    rows, ids = pd.factorize(df['sample_id'])
+    cols, taxa = pd.factorize(df['taxon'])
+    matrix = sparse.csr_matrix((df['count'].to_numpy(), (rows, cols)), shape=(len(ids), len(taxa)))
+    return np.asarray(ids, dtype=str), matrix, ABUNDANCE_PATH
+
+
+def condensed_index(i, j, n):
+    """Position of (i, j), i < j, in the condensed vector (works on arrays)."""
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def tile_grid(n, tile_size):
+    """(row_start, row_stop, col_start, col_stop) of every tile on or above the diagonal."""
+    edges = list(range(0, n, tile_size)) + [n]
+    return [
+        (edges[a], edges[a + 1], edges[b], edges[b + 1])
+        for a in range(len(edges) - 1) for b in range(a, len(edges) - 1)
+    ]
+
+
+_state = {}
+
+
+def _init_worker(matrix, metric, path, n):
+    """Per-worker setup: the prepared matrix and a writable view of the output file."""
+    if metric == 'braycurtis':
+        totals = np.asarray(matrix.sum(axis=1)).ravel()
+        scale = np.divide(1.0, totals, out=np.zeros_like(totals), where=totals > 0)
+        matrix = sparse.diags(scale) @ matrix  # relative abundances: every row sums to 1
+        _state['sums'] = np.asarray(matrix.sum(axis=1)).ravel()
+    else:
+        matrix = (matrix > 0).astype(np.float32)
+        _state['sums'] = np.asarray(matrix.sum(axis=1)).ravel()  # taxa present per sample
+    _state['matrix'] = matrix.tocsr()
+    _state['metric'] = metric
+    _state['n'] = n
+    _state['out'] = np.memmap(path, dtype=np.float32, mode='r+', shape=(n * (n - 1) // 2,))
+
+
+def tile_distances(r0, r1, c0, c1):
+    """Dense (r1 - r0) x (c1 - c0) distances between two blocks of samples."""
+    X, s = _state['matrix'], _state['sums']
+    rows, cols = X[r0:r1], X[c0:c1]
+    if _state['metric'] == 'braycurtis':
+        numerator = manhattan_distances(rows, cols)
+        denominator = s[r0:r1, None] + s[None, c0:c1]
+    else:
+        shared = (rows @ cols.T).toarray()
+        numerator = s[r0:r1, None] + s[None, c0:c1] - 2 * shared  # |A | B| - |A & B|
+        denominator = numerator + shared                          # |A | B|
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator > 0)
+
+
+def _run_tile(tile):
+    """Computes one tile and writes its upper-triangle part into the memory-mapped output."""
+    r0, r1, c0, c1 = tile
+    d = tile_distances(r0, r1, c0, c1).astype(np.float32)
+    out, n = _state['out'], _state['n']
+    for i in range(r0, r1):
+        # Row i of the tile covers j in [max(c0, i + 1), c1): one contiguous run of the condensed vector
+        j0 = max(c0, i + 1)
+        if j0 < c1:
+            k = condensed_index(i, j0, n)
+            out[k:k + c1 - j0] = d[i - r0, j0 - c0:]
+    out.flush()
+    return tile
+
+
+def _paths(metric, source):
+    base = os.path.join(OUTPUT_DIR, f'{metric}_{source}')
+    return base + '.f32', base + '.ids.txt', base + '.manifest.json'
+
+
+def _save_manifest(path, manifest):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def compute_distances(metric='braycurtis', source='genus', tile_size=TILE_SIZE, workers=None, restart=False):
+    """Builds (or finishes) the condensed distance matrix on disk; returns its path."""
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {METRICS}, got {metric!r}")
+    data_path, ids_path, manifest_path = _paths(metric, source)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    print("1. Loading abundance matrix...")
+    sample_ids, matrix, input_path = load_matrix(source)
+    n = len(sample_ids)
+    print(f"   -> {n} samples x {matrix.shape[1]} taxa ({source}), {n * (n - 1) // 2:,} distances")
+
+    settings = {
+        'metric': metric, 'source': source, 'n': n, 'tile_size': tile_size,
+        'input_hash': file_fingerprint(input_path)['hash'],
+    }
+    manifest = None
+    if not restart and os.path.exists(manifest_path) and os.path.exists(data_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['settings'] != settings:
+            print("   -> Input or settings changed since the last run: starting over.")
+            manifest = None
+
+    if manifest is None:
+        manifest = {'settings': settings, 'done': []}
+        # Sized up front; the OS only allocates the pages the tiles write to
+        np.memmap(data_path, dtype=np.float32, mode='w+', shape=(max(n * (n - 1) // 2, 1),)).flush()
+        np.savetxt(ids_path, sample_ids, fmt='%s')
+        _save_manifest(manifest_path, manifest)
+
+    done = {tuple(t) for t in manifest['done']}
+    todo = [t for t in tile_grid(n, tile_size) if t not in done]
+    print(f"2. {len(todo)} of {len(todo) + len(done)} tiles to compute ({len(done)} already done)...")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(matrix, metric, data_path, n)) as pool:
+        futures = [pool.submit(_run_tile, t) for t in todo]
+        for finished, future in enumerate(as_completed(futures), start=1):
+            # Recorded only once the tile is flushed to disk, so a crash never marks a partial tile done
+            manifest['done'].append(list(future.result()))
+            _save_manifest(manifest_path, manifest)
+            print(f"      {finished}/{len(todo)} tiles", end='\r' if finished < len(todo) else '\n')
+
+    print(f"   -> {data_path} complete in {time.perf_counter() - start:.1f}s")
+    return data_path
+
+
+def load_distances(metric='braycurtis', source='genus'):
+    """(sample ids, condensed float32 distances, memory-mapped read-only) of a finished run."""
+    data_path, ids_path, manifest_path = _paths(metric, source)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    n, tile_size = manifest['settings']['n'], manifest['settings']['tile_size']
+    if len(manifest['done']) != len(tile_grid(n, tile_size)):
+        raise RuntimeError(f"{data_path} is incomplete; re-run beta_diversity.py to finish it")
+    sample_ids = np.loadtxt(ids_path, dtype=str, ndmin=1)
+    return sample_ids, np.memmap(data_path, dtype=np.float32, mode='r', shape=(n * (n - 1) // 2,))
+
+
+def square_distances(condensed, n, idx):
+    """Square distance matrix among the samples at positions idx (reads only those entries)."""
+    idx = np.asarray(idx)
+    i, j = np.minimum.outer(idx, idx), np.maximum.outer(idx, idx)
+    square = np.zeros(i.shape, dtype=np.float32)
+    off_diagonal = i != j
+    square[off_diagonal] = condensed[condensed_index(i[off_diagonal], j[off_diagonal], n)]
+    return square
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiled, resumable beta-diversity distance matrix.")
+    parser.add_argument('--metric', choices=METRICS, default='braycurtis')
+    parser.add_argument('--source', default='genus', help="'features' (BIOM observations) or a taxon_abundance rank")
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE, help="samples per tile side")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--restart', action='store_true', help="discard finished tiles and start over")
+    args = parser.parse_args()
+
+    print(f"--- Beta Diversity: {args.metric} over {args.source} ---")
+    compute_distances(args.metric, args.source, args.tile_size, args.workers, args.restart)
+    print("--- Success! ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Out-of-core reader for BIOM tables.
+
+biom.load_table() reads the whole count matrix into memory. HDF5 BIOM files
+(format 2.x) also store the matrix compressed by sample (sample/matrix:
+indptr, indices, data), so a block of consecutive samples is one contiguous
+slice of `indices` and `data`. iter_sample_blocks() reads those slices with
+h5py, one block at a time, so memory is bounded by the block size instead
+of the table size.
+"""
+import h5py
+import numpy as np
+from scipy import sparse
+
+BLOCK_SIZE = 2000  # samples per block
+
+
+def table_shape(path):
+    """
+    (n_observations, n_samples), for HDF5 files without reading the matrix.
+    JSON BIOM files are loaded whole, as in iter_sample_blocks().
+    """
+    if not h5py.is_hdf5(path):
+        import biom
+        return biom.load_table(path).shape
+
+    with h5py.File(path, 'r') as f:
+        return tuple(int(n) for n in f.attrs['shape'])
+
+
+def iter_sample_blocks(path, block_size=BLOCK_SIZE, dtype=np.float32):
+    """
+    Yields (sample ids, samples x observations CSR matrix) for consecutive
+    blocks of at most block_size samples. Observation columns are in the
+    order of observation/ids, the same order as taxonomy_index.
+    JSON BIOM files have no on-disk layout to stream from and are loaded whole.
+    """
+    if not h5py.is_hdf5(path):
+        import biom
+        table = biom.load_table(path)
+        sample_ids = np.asarray(table.ids(axis='sample'), dtype=str)
+        matrix = table.matrix_data.T.tocsr().astype(dtype)
+        for start in range(0, len(sample_ids), block_size):
+            yield sample_ids[start:start + block_size], matrix[start:start + block_size]
+        return
+
+    with h5py.File(path, 'r') as f:
+        n_observations, n_samples = (int(n) for n in f.attrs['shape'])
+        ids = f['sample/ids']
+        indptr = f['sample/matrix/indptr'][:]
+        indices = f['sample/matrix/indices']
+        data = f['sample/matrix/data']
+
+        for start in range(0, n_samples, block_size):
+            stop = min(start + block_size, n_samples)
+            lo, hi = indptr[start], indptr[stop]
+            block = sparse.csr_matrix(
+                (data[lo:hi].astype(dtype), indices[lo:hi], indptr[start:stop + 1] - lo),
+                shape=(stop - start, n_observations),
+            )
+            yield ids[start:stop].astype(str), block
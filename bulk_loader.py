@@ -0,0 +1,322 @@
+"""
+Bulk loader for PostgreSQL.
+
+Streams DataFrames into tables with COPY ... FROM STDIN from an in-memory CSV
+buffer instead of the row-wise INSERTs issued by DataFrame.to_sql.
+Given a DuckDB connection (MICROBIOME_BACKEND=duckdb) instead of an engine,
+every function hands the load to its counterpart in duckdb_backend.
+"""
+import io
+import os
+import time
+
+import duckdb_backend
+from data_access import is_embedded
+
+# Re-applied after swap_table() has replaced a table that views read from
+VIEWS_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema_views.sql')
+# Materialized views defined there; refresh_views() rebuilds them after a load
+MATERIALIZED_VIEWS = ['analysis_samples']
+
+
+def report_progress(rows_done, rows_total):
+    """Default progress callback: prints a one-line running count."""
+    pct = 100 * rows_done / rows_total if rows_total else 100
+    print(f"      {rows_done}/{rows_total} rows ({pct:.0f}%)", end='\r' if rows_done < rows_total else '\n')
+
+
+def _bump_versions(cur, tables):
+    """
+    Increments the load counters of `tables` in table_versions, inside the
+    caller's transaction, so data_access.query() drops results cached from
+    before the load exactly when the load commits.
+    """
+    for table in tables:
+        cur.execute(
+            "INSERT INTO table_versions (table_name, version) VALUES (%s, 1) "
+            "ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1, updated_at = now()",
+            (table,))
+
+
+def refresh_views(engine, views=MATERIALIZED_VIEWS):
+    """
+    Re-runs the queries behind the materialized views so they reflect the
+    tables just loaded. CONCURRENTLY (the views have a unique index) keeps them
+    readable by the analysis scripts while the new contents are computed.
+    A view's version is bumped only if its contents actually changed, so a
+    re-run that loaded nothing keeps the query cache warm.
+    """
+    if is_embedded(engine):
+        return duckdb_backend.refresh_views(engine, views)
+    start = time.perf_counter()
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        checksum = "SELECT md5(string_agg(v::text, '|' ORDER BY v::text)) FROM {} v"
+        for view in views:
+            cur.execute(checksum.format(view))
+            before = cur.fetchone()[0]
+            cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+            cur.execute(f"ANALYZE {view}")
+            cur.execute(checksum.format(view))
+            if cur.fetchone()[0] != before:
+                _bump_versions(cur, [view])
+        cur.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    print(f"   -> REFRESH {', '.join(views)} in {time.perf_counter() - start:.2f}s")
+
+
+def _copy_rows(cur, df, table, batch_size, progress=None):
+    """Runs one COPY FROM STDIN per batch of rows on an open cursor."""
+    columns = ', '.join(f'"{c}"' for c in df.columns)
+    copy_sql = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+    total = len(df)
+    for offset in range(0, total, batch_size):
+        # NaN/None are written as empty fields, which COPY reads as NULL
+        buf = io.StringIO()
+        df.iloc[offset:offset + batch_size].to_csv(buf, index=False, header=False)
+        buf.seek(0)
+        cur.copy_expert(copy_sql, buf)
+        if progress:
+            progress(min(offset + batch_size, total), total)
+
+
+def copy_frame(df, table, engine, if_exists='append', batch_size=50000, progress=None):
+    """
+    Loads a DataFrame into a table with COPY FROM STDIN, batch_size rows per COPY.
+
+    if_exists: 'append'   -> table must already exist (e.g. from schema_creation.sql)
+               'truncate' -> empty the existing table first
+               'replace'  -> drop and recreate the table from the frame's columns, like to_sql
+    progress:  optional callback(rows_done, rows_total), called after every batch.
+
+    All batches run in one transaction, so a failed load leaves the table untouched.
+    Returns the number of rows loaded.
+    """
+    if if_exists not in ('append', 'truncate', 'replace'):
+        raise ValueError(f"if_exists must be 'append', 'truncate' or 'replace', got {if_exists!r}")
+    if is_embedded(engine):
+        return duckdb_backend.copy_frame(df, table, engine, if_exists)
+
+    if if_exists == 'replace':
+        # Let pandas pick the column types, then fill the empty table with COPY
+        df.head(0).to_sql(table, engine, if_exists='replace', index=False)
+
+    total = len(df)
+    start = time.perf_counter()
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        if if_exists == 'truncate':
+            cur.execute(f"TRUNCATE TABLE {table}")
+        _copy_rows(cur, df, table, batch_size, progress)
+        _bump_versions(cur, [table])
+        cur.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else float('inf')
+    print(f"   -> COPY {table}: {total} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    return total
+
+
+def replace_rows(df, table, engine, key='sample_id', parent=None, batch_size=50000, progress=None):
+    """
+    Replaces every row of `table` whose key value appears in df with df's rows.
+    The rows are COPY'd into a temporary table first; with `parent`, rows whose
+    key has no match there (orphans) are dropped server-side. The old rows of
+    the remaining keys are then deleted and the new ones inserted, all in one
+    transaction. For long tables with several rows per key, where ON CONFLICT
+    cannot drop stale rows.
+    Returns (deleted, inserted, list of the keys that were loaded).
+    """
+    if is_embedded(engine):
+        return duckdb_backend.replace_rows(df, table, engine, key, parent)
+    columns = ', '.join(f'"{c}"' for c in df.columns)
+    stage = f"{table}_replace"
+    start = time.perf_counter()
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"CREATE TEMP TABLE {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        _copy_rows(cur, df, stage, batch_size, progress)
+        if parent:
+            cur.execute(f'DELETE FROM {stage} s WHERE NOT EXISTS '
+                        f'(SELECT 1 FROM {parent} p WHERE p."{key}" = s."{key}")')
+        cur.execute(f'SELECT DISTINCT "{key}" FROM {stage}')
+        keys = [row[0] for row in cur.fetchall()]
+        cur.execute(f'DELETE FROM {table} t USING (SELECT DISTINCT "{key}" FROM {stage}) s '
+                    f'WHERE t."{key}" = s."{key}"')
+        deleted = cur.rowcount
+        cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage}")
+        inserted = cur.rowcount
+        _bump_versions(cur, [table])
+        cur.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"   -> REPLACE {table}: {deleted} rows deleted, {inserted} inserted "
+          f"({len(df) - inserted} orphans dropped) in {elapsed:.2f}s")
+    return deleted, inserted, keys
+
+
+def swap_table(df, table, engine, parent=None, key='sample_id', batch_size=50000, progress=None):
+    """
+    Rebuilds `table` from df without readers ever seeing it empty or half-loaded.
+
+    1. COPY df into a staging table with the same columns but no indexes or constraints
+    2. drop orphans server-side: rows whose key has no match in `parent` (anti-join)
+    3. build the live table's constraints and indexes on the staging table
+    4. one short transaction: drop the live table, rename the staging table (and its
+       constraints and indexes) into place and re-create the views from schema_views.sql
+
+    Until step 4 commits, queries keep reading the old table. Tables that other
+    tables reference with foreign keys cannot be swapped this way.
+    Returns (rows kept, orphans dropped).
+    """
+    if is_embedded(engine):
+        return duckdb_backend.swap_table(df, table, engine, parent, key)
+    stage = f"{table}_staging"
+    start = time.perf_counter()
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT count(*) FROM pg_constraint WHERE confrelid = %s::regclass", (table,))
+        if cur.fetchone()[0]:
+            raise ValueError(f"{table} is referenced by foreign keys and cannot be swapped")
+
+        # The live table's constraints and its standalone indexes, rebuilt on the staging table
+        cur.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass ORDER BY contype = 'f', conname", (table,))
+        constraints = cur.fetchall()
+        cur.execute(
+            "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = %s::regclass "
+            "AND i.indexrelid NOT IN (SELECT conindid FROM pg_constraint WHERE conrelid = %s::regclass)",
+            (table, table))
+        indexes = cur.fetchall()
+
+        # 1-2. Load without any index to maintain, then drop the orphans in one statement
+        cur.execute(f"DROP TABLE IF EXISTS {stage}")
+        cur.execute(f"CREATE TABLE {stage} (LIKE {table} INCLUDING DEFAULTS)")
+        _copy_rows(cur, df, stage, batch_size, progress)
+        orphans = 0
+        if parent:
+            cur.execute(f'DELETE FROM {stage} s WHERE NOT EXISTS '
+                        f'(SELECT 1 FROM {parent} p WHERE p."{key}" = s."{key}")')
+            orphans = cur.rowcount
+
+        # 3. Constraints and indexes, built once over the finished data
+        for name, definition in constraints:
+            cur.execute(f'ALTER TABLE {stage} ADD CONSTRAINT "{name}_staging" {definition}')
+        for name, definition in indexes:
+            unique = 'UNIQUE ' if definition.startswith('CREATE UNIQUE') else ''
+            cur.execute(f'CREATE {unique}INDEX "{name}_staging" ON {stage} USING {definition.split(" USING ", 1)[1]}')
+        cur.execute(f"ANALYZE {stage}")
+        conn.commit()
+        loaded_at = time.perf_counter()
+
+        # 4. The swap: readers wait only for this short transaction
+        cur.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        cur.execute(f"DROP TABLE {table} CASCADE")  # dependent views come back from VIEWS_SQL below
+        cur.execute(f"ALTER TABLE {stage} RENAME TO {table}")
+        for name, _ in constraints:
+            cur.execute(f'ALTER TABLE {table} RENAME CONSTRAINT "{name}_staging" TO "{name}"')
+        for name, _ in indexes:
+            cur.execute(f'ALTER INDEX "{name}_staging" RENAME TO "{name}"')
+        with open(VIEWS_SQL) as f:
+            cur.execute(f.read())
+        _bump_versions(cur, [table] + MATERIALIZED_VIEWS)  # re-created with the new rows
+        cur.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    swap_ms = (time.perf_counter() - loaded_at) * 1000
+    print(f"   -> SWAP {table}: {len(df) - orphans} rows loaded, {orphans} orphans dropped "
+          f"in {time.perf_counter() - start:.2f}s (swap held locks for {swap_ms:.0f} ms)")
+    return len(df) - orphans, orphans
+
+
+def _upsert_rows(cur, df, table, key, batch_size, progress=None):
+    """One upsert on an open cursor (see upsert_frame); returns (inserted, updated)."""
+    keys = [key] if isinstance(key, str) else list(key)
+    columns = ', '.join(f'"{c}"' for c in df.columns)
+    key_list = ', '.join(f'"{k}"' for k in keys)
+    updates = ', '.join(f'"{c}" = EXCLUDED."{c}"' for c in df.columns if c not in keys)
+    on_conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    stage = f"{table}_upsert"
+
+    cur.execute(f"CREATE TEMP TABLE {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+    _copy_rows(cur, df, stage, batch_size, progress)
+    # xmax is 0 only for freshly inserted tuples, which tells inserts from updates
+    cur.execute(
+        f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} "
+        f"ON CONFLICT ({key_list}) {on_conflict} RETURNING (xmax = 0)"
+    )
+    flags = [row[0] for row in cur.fetchall()]
+    _bump_versions(cur, [table])
+    inserted = sum(flags)
+    return inserted, len(flags) - inserted
+
+
+def upsert_frame(df, table, engine, key='sample_id', batch_size=50000, progress=None):
+    """
+    Inserts new rows and updates existing ones (matched on the key columns)
+    with INSERT ... ON CONFLICT. The rows are COPY'd into a temporary table
+    first, so the upsert itself is one set-based statement in one transaction.
+
+    The target table needs a primary key or unique constraint on `key`.
+    Returns (inserted, updated).
+    """
+    return upsert_frames([(df, table, key)], engine, batch_size, progress)[0]
+
+
+def upsert_frames(frames, engine, batch_size=50000, progress=None):
+    """
+    upsert_frame() for several tables, [(df, table, key), ...], in one
+    transaction: either every table gets its rows or none does.
+    Returns [(inserted, updated), ...] in the same order.
+    """
+    if is_embedded(engine):
+        return duckdb_backend.upsert_frames(frames, engine)
+    start = time.perf_counter()
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        counts = [_upsert_rows(cur, df, table, key, batch_size, progress) for df, table, key in frames]
+        cur.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    for (_, table, _), (inserted, updated) in zip(frames, counts):
+        print(f"   -> UPSERT {table}: {inserted} inserted, {updated} updated in {elapsed:.2f}s")
+    return counts
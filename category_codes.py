@@ -0,0 +1,56 @@
+"""
+Dictionary encoding of the survey answer columns.
+
+The frequency/lifestyle fields repeat the same handful of long strings
+('Regularly (3-5 times/week)', ...) on every row. They are stored in
+samples_coded as SMALLINT codes into category_labels; the `samples` view
+joins the labels back so queries still see the original text, and carries
+the codes along as <column>_code. code_filter() turns a label filter into
+one on those codes, which is what the analysis_samples indexes cover.
+"""
+import pandas as pd
+from bulk_loader import copy_frame
+from data_access import read_frame
+
+CATEGORICAL_COLUMNS = [
+    'antibiotic_history', 'diet_type', 'alcohol_freq', 'red_meat_freq',
+    'probiotic_freq', 'vitamin_b_freq', 'vitamin_d_freq', 'multivitamin_freq', 'acne_med_freq'
+]
+
+
+def load_dictionary(engine):
+    """label -> code for every label already in category_labels."""
+    known = read_frame("SELECT code, label FROM category_labels", engine)
+    return pd.Series(known['code'].to_numpy(), index=known['label'].to_numpy())
+
+
+def encode_categories(df, engine, columns=CATEGORICAL_COLUMNS):
+    """
+    Returns a copy of df with the label columns replaced by their codes.
+    Labels not seen before are appended to category_labels first.
+    """
+    present = [c for c in columns if c in df.columns]
+    dictionary = load_dictionary(engine)
+
+    labels = pd.unique(df[present].stack().dropna().to_numpy())
+    new_labels = sorted(set(labels) - set(dictionary.index))
+    if new_labels:
+        next_code = int(dictionary.max()) + 1 if len(dictionary) else 1
+        new_rows = pd.DataFrame({'code': range(next_code, next_code + len(new_labels)), 'label': new_labels})
+        copy_frame(new_rows, 'category_labels', engine)
+        dictionary = pd.concat([dictionary, pd.Series(new_rows['code'].to_numpy(), index=new_labels)])
+        print(f"   -> Added {len(new_labels)} new labels to category_labels ({len(dictionary)} total).")
+
+    encoded = df.copy()
+    for col in present:
+        encoded[col] = encoded[col].map(dictionary).astype('Int16')
+    return encoded
+
+
+def code_filter(column, labels):
+    """
+    SQL condition selecting the rows whose `column` answer is one of `labels`,
+    evaluated on the SMALLINT <column>_code (the labels are looked up once).
+    """
+    quoted = ', '.join("'" + label.replace("'", "''") + "'" for label in labels)
+    return f"{column}_code IN (SELECT code FROM category_labels WHERE label IN ({quoted}))"
@@ -0,0 +1,239 @@
+"""
+Embedded DuckDB backend (MICROBIOME_BACKEND=duckdb).
+
+The same tables, views and queries as the PostgreSQL server, in a single
+file (data/microbiome.duckdb by default) created from schema_duckdb.sql on
+first use, so the pipeline runs with no database server. DuckDB executes
+the GROUP BY / CASE analysis queries column-wise and vectorized.
+
+bulk_loader and data_access hand their work to the functions here when
+they are given a DuckDB connection instead of a SQLAlchemy engine. DataFrames
+go in through DuckDB's zero-copy pandas scan (no CSV round trip) and results
+come back as Arrow tables. The file takes one writing process at a time, so
+run_pipeline.py runs the stages one after the other with this backend.
+"""
+import os
+import re
+import time
+
+import pyarrow as pa
+
+SCHEMA_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema_duckdb.sql')
+FRAME = '_frame'  # name the loaded DataFrame is registered under
+
+
+def connect(path):
+    """Opens (creating it with the schema if it does not exist) the database file."""
+    import duckdb  # only needed with this backend
+
+    new = not os.path.exists(path)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = duckdb.connect(path)
+    if new:
+        with open(SCHEMA_SQL) as f:
+            conn.execute(f.read())
+    return conn
+
+
+def to_duckdb_params(sql, params):
+    """Rewrites psycopg2's %(name)s placeholders as DuckDB's $name."""
+    if not params:
+        return sql, None
+    return re.sub(r'%\((\w+)\)s', r'$\1', sql), params
+
+
+def read_arrow(conn, sql, params=None):
+    sql, params = to_duckdb_params(sql, params)
+    return conn.execute(sql, params).to_arrow_table()
+
+
+def iter_batches(conn, sql, params=None, batch_size=100000):
+    sql, params = to_duckdb_params(sql, params)
+    yield from conn.execute(sql, params).to_arrow_reader(batch_size)
+
+
+def execute(conn, sql, params=None):
+    sql, params = to_duckdb_params(sql, params)
+    conn.execute(sql, params)
+
+
+def table_versions(conn, sql):
+    """
+    {table: [updated_at, version]} for the tables the query reads, views
+    followed through their definitions. updated_at tells a rebuilt database
+    (whose counters start over) from the one a cache entry was built from.
+    """
+    views = dict(conn.execute(
+        "SELECT view_name, sql FROM duckdb_views() WHERE NOT internal AND NOT temporary").fetchall())
+    names, todo = set(), [sql]
+    while todo:
+        for name in re.findall(r'[a-z_][a-z0-9_]*', todo.pop().lower()):
+            if name not in names:
+                names.add(name)
+                if name in views:
+                    todo.append(views[name])
+    rows = conn.execute(
+        "SELECT table_name, updated_at, version FROM table_versions "
+        "WHERE table_name IN (SELECT unnest($names)) ORDER BY table_name", {'names': sorted(names)}).fetchall()
+    return {name: [str(updated_at), int(version)] for name, updated_at, version in rows}
+
+
+def _bump_versions(conn, tables):
+    for table in tables:
+        conn.execute(
+            "INSERT INTO table_versions (table_name, version) VALUES (?, 1) "
+            "ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1, updated_at = now()",
+            [table])
+
+
+def _transaction(conn, work):
+    """Runs work() in one transaction with df registered as FRAME; returns its result."""
+    conn.begin()
+    try:
+        result = work()
+        conn.commit()
+        return result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.unregister(FRAME)
+
+
+def _drop_orphans(conn, parent, key):
+    """Number of FRAME rows whose key has no match in parent; the select that leaves them out."""
+    select = f'SELECT * FROM {FRAME}'
+    if not parent:
+        return 0, select
+    select += f' f WHERE EXISTS (SELECT 1 FROM {parent} p WHERE p."{key}" = f."{key}")'
+    total = conn.execute(f'SELECT count(*) FROM {FRAME}').fetchone()[0]
+    kept = conn.execute(f'SELECT count(*) FROM ({select})').fetchone()[0]
+    return total - kept, select
+
+
+def copy_frame(df, table, conn, if_exists='append'):
+    start = time.perf_counter()
+
+    def work():
+        if if_exists == 'replace':
+            conn.execute(f'CREATE OR REPLACE TABLE {table} AS SELECT * FROM {FRAME}')
+        else:
+            if if_exists == 'truncate':
+                conn.execute(f'DELETE FROM {table}')
+            conn.execute(f'INSERT INTO {table} BY NAME SELECT * FROM {FRAME}')
+        _bump_versions(conn, [table])
+
+    conn.register(FRAME, df)
+    _transaction(conn, work)
+    elapsed = time.perf_counter() - start
+    rate = len(df) / elapsed if elapsed > 0 else float('inf')
+    print(f"   -> INSERT {table}: {len(df)} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    return len(df)
+
+
+def replace_rows(df, table, conn, key='sample_id', parent=None):
+    start = time.perf_counter()
+
+    def work():
+        _, select = _drop_orphans(conn, parent, key)
+        conn.execute(f'CREATE TEMP TABLE {table}_replace AS {select}')
+        try:
+            keys = [row[0] for row in conn.execute(f'SELECT DISTINCT "{key}" FROM {table}_replace').fetchall()]
+            deleted = conn.execute(
+                f'DELETE FROM {table} WHERE "{key}" IN (SELECT "{key}" FROM {table}_replace)').fetchone()[0]
+            inserted = conn.execute(f'INSERT INTO {table} BY NAME SELECT * FROM {table}_replace').fetchone()[0]
+        finally:
+            conn.execute(f'DROP TABLE {table}_replace')
+        _bump_versions(conn, [table])
+        return deleted, inserted, keys
+
+    conn.register(FRAME, df)
+    deleted, inserted, keys = _transaction(conn, work)
+    print(f"   -> REPLACE {table}: {deleted} rows deleted, {inserted} inserted "
+          f"({len(df) - inserted} orphans dropped) in {time.perf_counter() - start:.2f}s")
+    return deleted, inserted, keys
+
+
+def swap_table(df, table, conn, parent=None, key='sample_id'):
+    """
+    Replaces the table's contents in one transaction. DuckDB's MVCC keeps
+    the old rows visible to other readers until the commit, which is what
+    the staging table and rename achieve on PostgreSQL.
+    """
+    start = time.perf_counter()
+
+    def work():
+        orphans, select = _drop_orphans(conn, parent, key)
+        conn.execute(f'DELETE FROM {table}')
+        conn.execute(f'INSERT INTO {table} BY NAME {select}')
+        _bump_versions(conn, [table])
+        return orphans
+
+    conn.register(FRAME, df)
+    orphans = _transaction(conn, work)
+    print(f"   -> SWAP {table}: {len(df) - orphans} rows loaded, {orphans} orphans dropped "
+          f"in {time.perf_counter() - start:.2f}s")
+    return len(df) - orphans, orphans
+
+
+def _upsert_rows(conn, df, table, key):
+    """One upsert of df (registered as FRAME) inside the caller's transaction; returns (inserted, updated)."""
+    keys = [key] if isinstance(key, str) else list(key)
+    columns = ', '.join(f'"{c}"' for c in df.columns)
+    key_list = ', '.join(f'"{k}"' for k in keys)
+    updates = ', '.join(f'"{c}" = EXCLUDED."{c}"' for c in df.columns if c not in keys)
+    on_conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    match = ' AND '.join(f't."{k}" = f."{k}"' for k in keys)
+
+    conn.register(FRAME, df)
+    try:
+        # DuckDB has no xmax to tell inserts from updates: count the existing keys first
+        updated = conn.execute(
+            f'SELECT count(*) FROM {FRAME} f WHERE EXISTS (SELECT 1 FROM {table} t WHERE {match})').fetchone()[0]
+        conn.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {FRAME} ON CONFLICT ({key_list}) {on_conflict}')
+    finally:
+        conn.unregister(FRAME)
+    _bump_versions(conn, [table])
+    return len(df) - updated, updated
+
+
+def upsert_frames(frames, conn):
+    start = time.perf_counter()
+    conn.begin()
+    try:
+        counts = [_upsert_rows(conn, df, table, key) for df, table, key in frames]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    elapsed = time.perf_counter() - start
+    for (_, table, _), (inserted, updated) in zip(frames, counts):
+        print(f"   -> UPSERT {table}: {inserted} inserted, {updated} updated in {elapsed:.2f}s")
+    return counts
+
+
+def refresh_views(conn, views):
+    """Rebuilds each materialized table from its <name>_source view; bumps it only if it changed."""
+    start = time.perf_counter()
+    checksum = "SELECT md5(string_agg(v::VARCHAR, '|' ORDER BY v::VARCHAR)) FROM {} v"
+    conn.begin()
+    try:
+        for view in views:
+            before = conn.execute(checksum.format(view)).fetchone()[0]
+            conn.execute(f'CREATE OR REPLACE TABLE {view} AS SELECT * FROM {view}_source')
+            if conn.execute(checksum.format(view)).fetchone()[0] != before:
+                _bump_versions(conn, [view])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"   -> REFRESH {', '.join(views)} in {time.perf_counter() - start:.2f}s")
+
+
+def arrow_dtypes(table):
+    """DECIMAL / HUGEINT results (e.g. SUM over integers) as float64, like NUMERIC on the server path."""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+    return table
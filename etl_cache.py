@@ -0,0 +1,140 @@
+"""
+Columnar on-disk cache for the cleaned ETL outputs.
+
+Frames are written as uncompressed Feather (Arrow IPC) files under
+data/cache/, next to a manifest of the source files they were built from
+(size, mtime and content hash; optional sources that do not exist are
+recorded as missing). When a later run finds the same sources,
+the frames are read back memory-mapped and the raw text files are not parsed.
+"""
+import ast
+import hashlib
+import json
+import os
+
+import pyarrow.feather as feather
+
+CACHE_DIR = os.path.join('data', 'cache')
+
+
+def file_hash(path, block_size=1 << 20):
+    """BLAKE2b digest of a file's content, read in 1 MB blocks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path, previous=None):
+    """
+    size, mtime and content hash of a file. Hashing is the expensive part, so
+    the previous fingerprint's hash is reused when size and mtime are unchanged.
+    """
+    st = os.stat(path)
+    fingerprint = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if previous and previous.get('size') == st.st_size and previous.get('mtime_ns') == st.st_mtime_ns:
+        fingerprint['hash'] = previous['hash']
+    else:
+        fingerprint['hash'] = file_hash(path)
+    return fingerprint
+
+
+def local_modules(script, seen=None):
+    """The script plus every project module it imports, followed recursively."""
+    seen = seen if seen is not None else set()
+    if script in seen or not os.path.exists(script):
+        return seen
+    seen.add(script)
+    with open(script, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=script)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            local_modules(name.split('.')[0] + '.py', seen)
+    return seen
+
+
+def _source_fingerprint(path, previous=None):
+    """file_fingerprint(), or {'missing': True} for a source that does not exist."""
+    if not os.path.exists(path):
+        return {'missing': True}
+    return file_fingerprint(path, previous)
+
+
+def _manifest_path(name):
+    return os.path.join(CACHE_DIR, f'{name}.manifest.json')
+
+
+def _frame_path(name, frame):
+    return os.path.join(CACHE_DIR, f'{name}.{frame}.feather')
+
+
+def load_cached(name, sources, params=None):
+    """
+    Returns {frame name: DataFrame} if the cache entry was built from the same
+    source content and params (JSON-compatible values), otherwise None.
+    A file that was only touched (new mtime, same hash) still counts as unchanged.
+    """
+    try:
+        with open(_manifest_path(name)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if manifest.get('params') != (params or {}) or sorted(manifest['sources']) != sorted(sources):
+        return None
+
+    touched = False
+    for path in sources:
+        previous = manifest['sources'][path]
+        exists = os.path.exists(path)
+        if exists == bool(previous.get('missing')):  # the source appeared or went away
+            return None
+        if not exists:
+            continue
+        if os.stat(path).st_size != previous['size']:
+            return None
+        current = file_fingerprint(path, previous)
+        if current['hash'] != previous['hash']:
+            return None
+        if current['mtime_ns'] != previous['mtime_ns']:
+            manifest['sources'][path] = current
+            touched = True
+
+    if touched:
+        # Remember the new mtimes so the next run can skip hashing again
+        with open(_manifest_path(name), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    try:
+        return {
+            frame: feather.read_table(_frame_path(name, frame), memory_map=True).to_pandas()
+            for frame in manifest['frames']
+        }
+    except FileNotFoundError:
+        return None
+
+
+def save_cached(name, sources, frames, params=None):
+    """Writes the frames, then the manifest (so a half-written entry is never picked up)."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if os.path.exists(_manifest_path(name)):
+        os.remove(_manifest_path(name))
+
+    for frame, df in frames.items():
+        # Feather needs a default index; uncompressed so reads can be memory-mapped
+        feather.write_feather(df.reset_index(drop=True), _frame_path(name, frame), compression='uncompressed')
+
+    manifest = {
+        'sources': {path: _source_fingerprint(path) for path in sources},
+        'params': params or {},
+        'frames': list(frames),
+    }
+    with open(_manifest_path(name), 'w') as f:
+        json.dump(manifest, f, indent=2)
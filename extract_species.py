@@ -1,15 +1,19 @@
-import biom
+import os
 import pandas as pd
 import numpy as np
+from scipy import sparse
+from biom_stream import iter_sample_blocks, table_shape
+from etl_cache import load_cached, local_modules, save_cached
+from taxonomy_index import RANKS, TaxonomyIndex, indicator_matrix
 
-print("--- Starting Keystone Species Extraction ---")
-
-# 1. Load BIOM (Lazy load)
-table = biom.load_table('data/ag-gg-100nt.biom')
+BIOM_PATH = 'data/ag-gg-100nt.biom'
+ABUNDANCE_PATH = 'data/taxon_abundance.csv'
+COLLAPSE_RANKS = ['phylum', 'class', 'order', 'family', 'genus']
+BLOCK_SIZE = 2000  # Samples read from the BIOM file at a time (bounds peak memory)
 
-print(f"   -> Table found. Samples: {table.shape[1]}")
+print("--- Starting Keystone Species Extraction ---")
 
-# 2. Define our Expanded Target List (Genus level)
+# Define our Expanded Target List (Genus level)
 # Note: 'Faecalibacterium' is the genus for F. prausnitzii
 # 'Akkermansia' is the genus for A. muciniphila
 target_genera = [
@@ -17,34 +21,84 @@ target_genera = [
     'akkermansia', 'faecalibacterium', 'lactobacillus' # The New Keystones
 ]
 
-ids_to_keep = []
-id_to_genus = {}
-
-print("2. Scanning taxonomy for Keystone species...")
-for obs_id in table.ids(axis='observation'):
-    meta = table.metadata(obs_id, axis='observation')
-    if meta and 'taxonomy' in meta:
-        tax_str = ';'.join(meta['taxonomy']).lower()
-        
-        for target in target_genera:
-            # Look for strict genus match "g__target"
-            if f'g__{target}' in tax_str:
-                ids_to_keep.append(obs_id)
-                id_to_genus[obs_id] = target
-                break
-
-# 3. Filter and Convert
-print(f"   -> Found {len(ids_to_keep)} matching strains.")
-subtable = table.filter(ids_to_keep, axis='observation', inplace=False)
-df = subtable.to_dataframe(dense=True)
-df.rename(index=id_to_genus, inplace=True)
-
-# 4. Aggregate
-print("4. Aggregating counts...")
-df_genus = df.groupby(df.index).sum().T
-df_genus.index.name = 'sample_id'
+
+def extract_abundance():
+    """
+    Streams the BIOM table in blocks of samples and collapses each block at
+    every rank from phylum to genus in one sparse product. The non-zero
+    (sample_id, rank, taxon, count, rel_abundance) rows are appended to
+    ABUNDANCE_PATH block by block; the wide keystone-genus table is returned.
+    """
+    # 1. Open BIOM (only the shape; counts are read block by block below)
+    n_observations, n_samples = table_shape(BIOM_PATH)
+
+    print(f"   -> Table found. Samples: {n_samples}")
+
+    print("2. Loading the taxonomy index...")
+    # Parsed once per BIOM file and cached; names are matched exactly per rank
+    index = TaxonomyIndex.load(BIOM_PATH)
+    if len(index.observation_ids) != n_observations:
+        raise ValueError(f"Taxonomy index of {BIOM_PATH} is out of step with its observations")
+
+    # One indicator block per rank, stacked: every taxon of every rank is one column
+    blocks, taxa = [], []
+    for rank in COLLAPSE_RANKS:
+        blocks.append(indicator_matrix(index.codes[:, RANKS.index(rank)], len(index.names[rank])))
+        taxa.append(pd.DataFrame({'rank': rank, 'taxon': index.names[rank]}))
+    taxa = pd.concat(taxa, ignore_index=True)
+    collapse = sparse.vstack(blocks).T.tocsr()  # observations x taxa
+
+    genus_of = index.assign('genus', target_genera)
+    keystone = indicator_matrix(genus_of, len(target_genera)).T.tocsr()  # observations x keystone genera
+    print(f"   -> Found {(genus_of >= 0).sum()} matching strains.")
+
+    # 3-4. Collapse block by block; only one block of counts is in memory at a time
+    print(f"3. Collapsing counts at {', '.join(COLLAPSE_RANKS)} ({BLOCK_SIZE} samples per block)...")
+    partial_path = ABUNDANCE_PATH + '.partial'
+    genus_blocks, n_rows = [], 0
+    for i, (sample_ids, counts) in enumerate(iter_sample_blocks(BIOM_PATH, BLOCK_SIZE)):
+        collapsed = (counts @ collapse).tocoo()  # samples x taxa, sparse
+        collapsed.eliminate_zeros()
+        reads = np.asarray(counts.sum(axis=1)).ravel()  # total reads per sample
+
+        df_block = pd.DataFrame({
+            'sample_id': sample_ids[collapsed.row],
+            'rank': taxa['rank'].to_numpy()[collapsed.col],
+            'taxon': taxa['taxon'].to_numpy()[collapsed.col],
+            'count': collapsed.data.round().astype(np.int64),
+            'rel_abundance': (collapsed.data / reads[collapsed.row]).astype(np.float32),
+        })
+        df_block.to_csv(partial_path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+        n_rows += len(df_block)
+
+        genus_blocks.append(pd.DataFrame((counts @ keystone).toarray(), index=sample_ids, columns=target_genera))
+        print(f"   -> {min((i + 1) * BLOCK_SIZE, n_samples)}/{n_samples} samples, {n_rows} non-zero entries")
+
+    # Only replace the previous output once the whole table went through
+    os.replace(partial_path, ABUNDANCE_PATH)
+
+    print("4. Aggregating Keystone genera...")
+    df_genus = pd.concat(genus_blocks)
+    # Same shape as before: only genera present in the table, in alphabetical order
+    present = np.bincount(genus_of[genus_of >= 0], minlength=len(target_genera)) > 0
+    df_genus = df_genus.loc[:, present].sort_index(axis=1)
+    df_genus.index.name = 'sample_id'
+    return df_genus
+
+
+# Both outputs only change when the BIOM file, this script or a local module it
+# imports (BIOM reader, taxonomy parsing) does
+cache_sources = [BIOM_PATH] + sorted(local_modules(__file__))
+cached = load_cached('extract_species', cache_sources)
+
+if cached and os.path.exists(ABUNDANCE_PATH):
+    print(f"1-4. BIOM file unchanged: keeping {ABUNDANCE_PATH}, loading genus table from data/cache/...")
+    df_genus = cached['genus'].set_index('sample_id')
+else:
+    df_genus = extract_abundance()
+    save_cached('extract_species', cache_sources, {'genus': df_genus.reset_index()})
 
 # 5. Save
 print("5. Saving to CSV...")
 df_genus.to_csv('data/species_counts.csv')
-print("--- Success! Created expanded 'species_counts.csv' ---")
\ No newline at end of file
+print(f"--- Success! Created '{ABUNDANCE_PATH}' and expanded 'species_counts.csv' ---")
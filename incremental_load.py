@@ -0,0 +1,105 @@
+"""
+Incremental, idempotent table sync.
+
+Every cleaned row is hashed per sample. Rows whose hash matches the one
+recorded in etl_row_hashes by the previous run are skipped; only new or
+changed samples are upserted, so re-running the ETL on a mostly-unchanged
+dataset touches only the delta. Long tables (several rows per sample) are
+hashed per sample over all of its rows and replaced sample by sample.
+"""
+import numpy as np
+import pandas as pd
+from bulk_loader import replace_rows, upsert_frame
+from data_access import execute, read_frame
+
+HASH_TABLE = 'etl_row_hashes'
+
+
+def row_hashes(df, key='sample_id'):
+    """One 64-bit hash per row (stored as signed BIGINT), computed vectorized over all columns."""
+    hashes = pd.util.hash_pandas_object(df.reset_index(drop=True), index=False)
+    return pd.DataFrame({key: df[key].to_numpy(), 'row_hash': hashes.to_numpy().view('int64')})
+
+
+def group_hashes(df, key='sample_id'):
+    """
+    One 64-bit hash per key value over all of its rows: the XOR of the row
+    hashes, so the order the rows arrive in does not matter.
+    """
+    if df.empty:
+        return pd.DataFrame({key: pd.Series(dtype=object), 'row_hash': pd.Series(dtype='int64')})
+    hashes = pd.util.hash_pandas_object(df.reset_index(drop=True), index=False).to_numpy()
+    keys = df[key].to_numpy()
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    combined = np.bitwise_xor.reduceat(hashes[order], starts)
+    return pd.DataFrame({key: sorted_keys[starts], 'row_hash': combined.view('int64')})
+
+
+def _changed(current, table, engine, key):
+    """Boolean mask over `current` (key, row_hash): True where the hash differs from the stored one."""
+    previous = read_frame(
+        f"SELECT sample_id AS {key}, row_hash FROM {HASH_TABLE} WHERE table_name = %(table)s",
+        engine, params={'table': table},
+    )
+    merged = current.merge(previous, on=key, how='left', suffixes=('', '_prev'))
+    return (merged['row_hash'] != merged['row_hash_prev']).to_numpy()
+
+
+def _record_hashes(hashes, table, engine, key):
+    new_hashes = hashes.rename(columns={key: 'sample_id'})
+    new_hashes.insert(0, 'table_name', table)
+    upsert_frame(new_hashes, HASH_TABLE, engine, key=['table_name', 'sample_id'])
+
+
+def forget_hashes(table, engine):
+    """Drops the stored hashes of a table rebuilt outside sync_*, so the next sync compares from scratch."""
+    execute(f"DELETE FROM {HASH_TABLE} WHERE table_name = %(table)s", engine, {'table': table})
+
+
+def sync_table(df, table, engine, key='sample_id'):
+    """
+    Upserts only the rows of df whose content changed since the last sync.
+    Returns a dict with the number of rows inserted, updated and skipped,
+    and the keys written.
+    """
+    current = row_hashes(df, key)
+    changed = _changed(current, table, engine, key)
+    delta = df[changed]
+
+    counts = {'inserted': 0, 'updated': 0, 'skipped': int(len(df) - changed.sum()), 'keys': list(delta[key])}
+    if not delta.empty:
+        counts['inserted'], counts['updated'] = upsert_frame(delta, table, engine, key=key)
+
+        # Record the new hashes only after the data itself is in place
+        _record_hashes(current[changed], table, engine, key)
+
+    print(f"   -> {table}: {counts['inserted']} inserted, {counts['updated']} updated, "
+          f"{counts['skipped']} unchanged (skipped)")
+    return counts
+
+
+def sync_long_table(df, table, engine, key='sample_id', parent=None):
+    """
+    Like sync_table for tables with many rows per key: every key whose rows
+    changed since the last sync has all of its rows replaced. With `parent`,
+    keys missing from that table are dropped server-side and not recorded,
+    so they are picked up once they appear there.
+    Returns a dict with the number of keys replaced and skipped, the rows
+    written and the keys replaced.
+    """
+    current = group_hashes(df, key)
+    changed = _changed(current, table, engine, key)
+    delta = df[df[key].isin(current.loc[changed, key])]
+
+    counts = {'replaced': 0, 'skipped': int(len(current) - changed.sum()), 'rows': 0, 'keys': []}
+    if not delta.empty:
+        _, counts['rows'], loaded = replace_rows(delta, table, engine, key=key, parent=parent)
+        counts['replaced'] = len(loaded)
+        counts['keys'] = loaded
+        _record_hashes(current[current[key].isin(loaded)], table, engine, key)
+
+    print(f"   -> {table}: {counts['replaced']} {key}s replaced ({counts['rows']} rows), "
+          f"{counts['skipped']} unchanged (skipped)")
+    return counts
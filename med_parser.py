@@ -0,0 +1,57 @@
+"""
+Medication keyword matcher for the free-text medication answers (Polypharmacy).
+
+Every keyword in drug_mapping.csv is compiled once into a single regex shaped
+like a prefix trie, so the regex engine walks each medication string like a
+multi-pattern automaton: one scan per string, no matter how many brand names
+the dictionary holds. Matches respect word boundaries and prefer the longest
+keyword ('zyrtec-d' over 'zyrtec').
+"""
+import re
+import pandas as pd
+
+# AGP puts the free-text medication answers in one of these columns
+MED_TEXT_COLUMNS = ['VIOLATION', 'subset_medication']
+
+
+def load_drug_dictionary(path):
+    """Reads drug_mapping.csv (utf-8-sig strips the BOM in front of 'keyword')."""
+    drugs = pd.read_csv(path, encoding='utf-8-sig', dtype=str)
+    drugs['keyword'] = drugs['keyword'].str.strip().str.lower()
+    return drugs.dropna(subset=['keyword']).drop_duplicates('keyword').reset_index(drop=True)
+
+
+def _trie_regex(node):
+    """Turns a nested-dict trie into a regex; '' marks the end of a keyword."""
+    branches = [re.escape(ch) + _trie_regex(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ''
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    # A keyword ending here makes the rest optional; greedy, so longer keywords win
+    return f'(?:{body})?' if '' in node else body
+
+
+def compile_keywords(keywords):
+    """One pattern for all keywords, anchored on word boundaries on both sides."""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+    return re.compile(rf'(?<!\w){_trie_regex(trie)}(?!\w)')
+
+
+def match_medications(df, drugs, text_col='med_text', id_col='sample_id'):
+    """
+    Scans every medication string once and returns the distinct
+    (sample_id, generic_name, drug_class) rows for patient_medications.
+    """
+    pattern = compile_keywords(drugs['keyword'])
+    texts = df[text_col].dropna().astype(str).str.lower()
+
+    found = texts.str.findall(pattern).explode().dropna()
+    matches = pd.DataFrame({id_col: df.loc[found.index, id_col].to_numpy(), 'keyword': found.to_numpy()})
+
+    meds = matches.merge(drugs, on='keyword')[[id_col, 'generic_name', 'drug_class']]
+    return meds.drop_duplicates().reset_index(drop=True)
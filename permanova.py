@@ -0,0 +1,258 @@
+"""
+Whole-community tests: PERMANOVA and ANOSIM on Bray-Curtis distances.
+
+Where stats_new_targets.py tests one genus at a time, these ask whether the
+composition of the key taxa differs between groups (diet, antibiotics, BMI).
+
+Both statistics reduce to sums over within-group pairs of the condensed
+distance vector (squared distances for PERMANOVA's pseudo-F, distance ranks
+for ANOSIM's R). The distances (float32) and their ranks (int32, doubled so
+tied average ranks stay integers) are written once to memory-mapped files
+that every worker process maps read-only; no n x n matrix is ever built.
+For a batch of permutations the one-hot group matrices are stacked side by
+side, and the condensed rows are expanded a block at a time, so the
+within-group sums of the whole batch come out of one matrix product per
+block. Every batch has its own SeedSequence child, so results do not depend
+on the number of workers.
+
+Usage:
+    python permanova.py                       # all tests, PERMUTATIONS below
+    python permanova.py --permutations 9999 --workers 8
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import cdist
+
+import data_access
+
+# CONFIGURATION
+PERMUTATIONS = 999
+BATCH_SIZE = 100   # permutations per matrix product / per task
+SEED = 42
+BLOCK_BYTES = 64 * 2 ** 20  # condensed rows expanded at a time (as float64)
+
+# Grouping column -> SQL expression over analysis_samples (NULL = not part of the test)
+GROUPINGS = {
+    'diet_group': 'diet_group',
+    'antibiotic_history': """
+        CASE
+            WHEN antibiotic_history IN ('Week', 'Month', '6 months', 'Year', 'I have not taken antibiotics in the past year.')
+            THEN antibiotic_history
+        END""",
+    'bmi_group': 'bmi_group',
+}
+
+
+def _row_start(i, n):
+    """Position of row i's first pair (i, i + 1) in the condensed vector; _row_start(n, n) is its length."""
+    return i * n - i * (i + 1) // 2
+
+
+def _rank_dtype(m):
+    """int32 holds the doubled ranks up to 2m for n below ~46,000 samples."""
+    return np.int32 if 2 * m < 2 ** 31 else np.int64
+
+
+def _row_blocks(n):
+    """(first row, stop row) blocks of the condensed matrix, sized to BLOCK_BYTES when expanded."""
+    rows = max(1, BLOCK_BYTES // (8 * max(n, 1)))
+    return [(a, min(a + rows, n)) for a in range(0, n - 1, rows)]
+
+
+def _upper_rows(condensed, n, a, b):
+    """Rows a..b-1 of the square matrix, upper triangle only (zeros on and below the diagonal)."""
+    block = np.zeros((b - a, n))
+    # Row-major order over j > i is exactly the condensed order
+    block[np.arange(n)[None, :] > np.arange(a, b)[:, None]] = \
+        condensed[_row_start(a, n):_row_start(b, n)]
+    return block
+
+
+def bray_curtis(abundances, path):
+    """Condensed float32 Bray-Curtis distances between the rows, written block by block to a memmap at path."""
+    n = len(abundances)
+    out = np.memmap(path, dtype=np.float32, mode='w+', shape=(max(n * (n - 1) // 2, 1),))
+    for a, b in _row_blocks(n):
+        d = cdist(abundances[a:b], abundances, 'braycurtis')
+        out[_row_start(a, n):_row_start(b, n)] = \
+            d[np.arange(n)[None, :] > np.arange(a, b)[:, None]]
+    out.flush()
+    return out
+
+
+def doubled_ranks(condensed, path):
+    """
+    2 x the average rank (ties share one, as in ANOSIM) of every distance, in
+    a memmap at path: average ranks are half-integers, so doubling keeps them
+    exact in an integer (4 bytes for most sizes, see _rank_dtype).
+    """
+    m = len(condensed)
+    order = np.argsort(condensed, kind='stable')
+    ordered = condensed[order]
+    out = np.memmap(path, dtype=_rank_dtype(m), mode='w+', shape=(max(m, 1),))
+    # The tie group of a value spans sorted positions [left, right): ranks left+1..right,
+    # average (left + right + 1) / 2. Done in slices to keep the temporaries small.
+    for k in range(0, m, 2 ** 22):
+        values = ordered[k:k + 2 ** 22]
+        left = np.searchsorted(ordered, values, side='left')
+        right = np.searchsorted(ordered, values, side='right')
+        out[order[k:k + 2 ** 22]] = left + right + 1
+    out.flush()
+    return out
+
+
+def within_sums(condensed, n, labels_batch, n_groups, square=False):
+    """
+    Sum of the condensed values (squared with square=True) over within-group
+    pairs i < j, per group, for every row of labels_batch (P x n). Returns P x n_groups.
+    """
+    P = labels_batch.shape[0]
+    onehot = np.zeros((n, P * n_groups))
+    onehot[np.arange(n)[:, None], np.arange(P) * n_groups + labels_batch.T] = 1.0
+    sums = np.zeros(P * n_groups)
+    for a, b in _row_blocks(n):
+        block = _upper_rows(condensed, n, a, b)
+        if square:
+            block *= block
+        # One GEMM per block for the whole batch; row i keeps only the column of its own group
+        sums += (onehot[a:b] * (block @ onehot)).sum(axis=0)
+    return sums.reshape(P, n_groups)
+
+
+def pseudo_f(distances, labels_batch, group_sizes, total_ss):
+    """PERMANOVA pseudo-F for every labelling (group sizes are fixed under permutation)."""
+    n, g = labels_batch.shape[1], len(group_sizes)
+    ss_within = (within_sums(distances, n, labels_batch, g, square=True) / group_sizes).sum(axis=1)
+    ss_between = total_ss - ss_within
+    return (ss_between / (g - 1)) / (ss_within / (n - g))
+
+
+def anosim_r(ranks2, labels_batch, group_sizes, total_rank_sum):
+    """ANOSIM R for every labelling (ranks2: the doubled ranks)."""
+    n = labels_batch.shape[1]
+    n_pairs = n * (n - 1) / 2
+    n_within = (group_sizes * (group_sizes - 1) / 2).sum()
+    within = within_sums(ranks2, n, labels_batch, len(group_sizes)).sum(axis=1) / 2
+    r_within = within / n_within
+    r_between = (total_rank_sum - within) / (n_pairs - n_within)
+    return (r_between - r_within) / (n_pairs / 2.0)
+
+
+_state = {}
+
+
+def _init_worker(distances_path, ranks_path, labels, group_sizes, total_ss, total_rank_sum):
+    """Per-worker setup: read-only maps of the shared files, plus the scalars every batch needs."""
+    m = max(len(labels) * (len(labels) - 1) // 2, 1)
+    _state.update(
+        distances=np.memmap(distances_path, dtype=np.float32, mode='r', shape=(m,)),
+        ranks=np.memmap(ranks_path, dtype=_rank_dtype(m), mode='r', shape=(m,)),
+        labels=labels, group_sizes=group_sizes, total_ss=total_ss, total_rank_sum=total_rank_sum,
+    )
+
+
+def _permutation_batch(seed, size):
+    """Statistics for `size` random relabellings: (pseudo-F array, R array)."""
+    rng = np.random.default_rng(seed)
+    batch = rng.permuted(np.tile(_state['labels'], (size, 1)), axis=1)
+    f = pseudo_f(_state['distances'], batch, _state['group_sizes'], _state['total_ss'])
+    r = anosim_r(_state['ranks'], batch, _state['group_sizes'], _state['total_rank_sum'])
+    return f, r
+
+
+def community_test(abundances, groups, permutations=PERMUTATIONS, seed=SEED, workers=None):
+    """
+    PERMANOVA + ANOSIM of Bray-Curtis distances between the rows of `abundances`
+    (relative abundances) across `groups`. Returns a dict of results.
+    """
+    labels, names = pd.factorize(groups)
+    group_sizes = np.bincount(labels).astype(float)
+    n = len(labels)
+    m = n * (n - 1) // 2
+
+    with tempfile.TemporaryDirectory(prefix='permanova-') as tmp:
+        distances_path, ranks_path = os.path.join(tmp, 'distances.f32'), os.path.join(tmp, 'ranks.i32')
+        distances = bray_curtis(abundances, distances_path)
+        ranks2 = doubled_ranks(distances, ranks_path)
+        total_ss = sum(np.square(distances[k:k + 2 ** 24], dtype=np.float64).sum()
+                       for k in range(0, m, 2 ** 24)) / n
+        total_rank_sum = m * (m + 1) / 2  # average ranks keep the sum of 1..m, ties or not
+
+        observed_f = pseudo_f(distances, labels[None, :], group_sizes, total_ss)[0]
+        observed_r = anosim_r(ranks2, labels[None, :], group_sizes, total_rank_sum)[0]
+
+        sizes = [BATCH_SIZE] * (permutations // BATCH_SIZE) + ([permutations % BATCH_SIZE] if permutations % BATCH_SIZE else [])
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(distances_path, ranks_path, labels, group_sizes,
+                                           total_ss, total_rank_sum)) as pool:
+            results = list(pool.map(_permutation_batch, seeds, sizes))
+        elapsed = time.perf_counter() - start
+        del distances, ranks2  # close the maps before the directory goes
+
+    perm_f = np.concatenate([f for f, _ in results])
+    perm_r = np.concatenate([r for _, r in results])
+    return {
+        'n': n,
+        'groups': ', '.join(f"{name} ({int(size)})" for name, size in zip(names, group_sizes)),
+        'pseudo_f': observed_f,
+        'permanova_p': (np.sum(perm_f >= observed_f) + 1) / (permutations + 1),
+        'anosim_r': observed_r,
+        'anosim_p': (np.sum(perm_r >= observed_r) + 1) / (permutations + 1),
+        'permutations': permutations,
+        'perms_per_sec': permutations / elapsed if elapsed > 0 else float('inf'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PERMANOVA / ANOSIM of the key taxa across diet, antibiotic and BMI groups.")
+    parser.add_argument('--permutations', type=int, default=PERMUTATIONS)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    args = parser.parse_args()
+
+    print("--- Community Composition Tests (PERMANOVA / ANOSIM, Bray-Curtis on key taxa) ---")
+
+    query = f"""
+    SELECT {', '.join(f'{expr} AS {name}' for name, expr in GROUPINGS.items())},
+           {', '.join(data_access.KEY_TAXA)}
+    FROM analysis_samples
+    WHERE has_taxa
+    ORDER BY sample_id
+    """
+    df = data_access.query(query)
+    totals = df[data_access.KEY_TAXA].sum(axis=1)
+    df = df[totals > 0]  # Bray-Curtis is undefined for samples without any key taxa
+    abundances = df[data_access.KEY_TAXA].div(totals[totals > 0], axis=0).to_numpy()
+
+    rows = []
+    for i, grouping in enumerate(GROUPINGS, start=1):
+        in_test = df[grouping].notna().to_numpy()
+        print(f"\n{i}. Testing: Does community composition differ by {grouping}?")
+        result = community_test(abundances[in_test], df.loc[in_test, grouping].to_numpy(),
+                                args.permutations, args.seed, args.workers)
+        print(f"   Groups: {result['groups']}")
+        print(f"   PERMANOVA pseudo-F: {result['pseudo_f']:.4f}  (p = {result['permanova_p']:.4f})")
+        print(f"   ANOSIM R:           {result['anosim_r']:.4f}  (p = {result['anosim_p']:.4f})")
+        print(f"   {result['permutations']} permutations at {result['perms_per_sec']:,.0f} permutations/sec")
+        if result['permanova_p'] < 0.05:
+            print("   RESULT: SIGNIFICANT. The groups have different community compositions.")
+        else:
+            print("   RESULT: Not significant.")
+        rows.append({'grouping': grouping, **result})
+
+    os.makedirs('results', exist_ok=True)
+    pd.DataFrame(rows).to_csv('results/permanova.csv', index=False)
+    print("\nResults saved to 'results/permanova.csv'")
+
+
+if __name__ == "__main__":
+    main()
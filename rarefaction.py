@@ -0,0 +1,192 @@
+"""
+Reader for the QIIME alpha-rarefaction tables (shannon.txt, PD_whole_tree.txt, observed_otus.txt).
+
+These files are very wide: one column per sample and one row per
+(depth, iteration). Instead of parsing the whole table, RarefactionFile
+indexes the rows by depth once, looking only at the first three fields of
+each line, and then parses just the rows of the requested depth straight
+into a float array.
+"""
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_access import read_frame
+
+# Rarefaction file -> metric name (matches the gut_metrics columns)
+METRIC_FILES = {
+    'shannon.txt': 'shannon_entropy',
+    'PD_whole_tree.txt': 'phylogenetic_diversity',
+    'observed_otus.txt': 'species_count',
+}
+
+
+class RarefactionFile:
+    """Depth-indexed view of one alpha-rarefaction file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.depth_index = {}  # depth -> [(byte offset, byte length), ...] one per iteration
+
+        with open(path, 'rb') as f:
+            header = f.readline()
+            fields = header.rstrip(b'\r\n').split(b'\t')
+            if len(fields) < 4 or b'sequences' not in fields[1].lower():
+                raise ValueError(f"{path} does not look like an alpha rarefaction table")
+            self.sample_ids = [s.decode() for s in fields[3:]]
+
+            offset = len(header)
+            for line in f:
+                # Slice out the depth field only; the rest of the (huge) line is never split
+                first = line.find(b'\t')
+                second = line.find(b'\t', first + 1)
+                if second > 0:
+                    depth = int(float(line[first + 1:second]))
+                    self.depth_index.setdefault(depth, []).append((offset, len(line)))
+                offset += len(line)
+
+    @property
+    def depths(self):
+        return sorted(self.depth_index)
+
+    def read_depth(self, depth):
+        """
+        Per-sample mean over all iterations at one depth, as a float32 array
+        aligned with self.sample_ids. Samples with no value (n/a) at this depth are NaN.
+        """
+        if depth not in self.depth_index:
+            raise KeyError(f"Depth {depth} not found in {self.path} (available: {self.depths})")
+
+        with open(self.path, 'rb') as f:
+            rows = []
+            for offset, length in self.depth_index[depth]:
+                f.seek(offset)
+                rows.append(f.read(length))
+
+        values = pd.read_csv(
+            io.BytesIO(b''.join(rows)), sep='\t', header=None,
+            usecols=range(3, 3 + len(self.sample_ids)), na_values=['n/a'], dtype=np.float64,
+        ).to_numpy()
+
+        # Averaged in float64, stored compact like the alpha_rarefaction frame
+        return _nan_mean(values).astype(np.float32)
+
+    def read_all_depths(self):
+        """
+        Summarises every depth of every curve in one pass.
+        Returns a long DataFrame (sample_id, depth, mean, std, n_iterations),
+        with no rows for depths a sample never reached.
+        """
+        raw = pd.read_csv(
+            self.path, sep='\t', header=0, usecols=range(1, 3 + len(self.sample_ids)),
+            na_values=['n/a'], dtype=np.float64,
+        ).to_numpy()
+        row_depths = raw[:, 0].astype(np.int64)
+        values = raw[:, 2:]
+
+        # Group the iteration rows by depth (stable, so file order is kept within a depth)
+        order = np.argsort(row_depths, kind='stable')
+        values = values[order]
+        depths, starts = np.unique(row_depths[order], return_index=True)
+        group_of_row = np.repeat(np.arange(len(depths)), np.diff(np.append(starts, len(order))))
+
+        valid = ~np.isnan(values)
+        n_iter = np.add.reduceat(valid, starts, axis=0)
+        totals = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = totals / n_iter
+            # Two-pass variance: squared deviations from the per-depth mean
+            dev = np.where(valid, values - means[group_of_row], 0.0)
+            std = np.sqrt(np.add.reduceat(dev * dev, starts, axis=0) / (n_iter - 1))
+
+        n_samples = len(self.sample_ids)
+        frame = pd.DataFrame({
+            'sample_id': np.tile(np.asarray(self.sample_ids, dtype=object), len(depths)),
+            'depth': np.repeat(depths, n_samples),
+            'mean': means.ravel().astype(np.float32),
+            'std': std.ravel().astype(np.float32),
+            'n_iterations': n_iter.ravel().astype(np.int16),
+        })
+        return frame[frame['n_iterations'] > 0].reset_index(drop=True)
+
+
+def _nan_mean(values):
+    """Column means ignoring NaN (all-NaN columns give NaN without a warning)."""
+    n_valid = np.count_nonzero(~np.isnan(values), axis=0)
+    totals = np.nansum(values, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(n_valid > 0, totals / n_valid, np.nan)
+
+
+def find_file(filename):
+    """Files live in data/ but older checkouts kept them in the project root."""
+    path = os.path.join('data', filename)
+    return path if os.path.exists(path) else filename
+
+
+def read_metric_frame(filename, column, depth=10000):
+    """Returns a (sample_id, column) DataFrame of per-sample means at one depth."""
+    rare = RarefactionFile(find_file(filename))
+    means = rare.read_depth(depth)
+    return pd.DataFrame({'sample_id': rare.sample_ids, column: means})
+
+
+def build_store_frame(files=METRIC_FILES):
+    """
+    Long-format alpha_rarefaction rows for every metric file, all depths.
+    The files are independent, so they are parsed in parallel threads.
+    """
+    def summarise(filename, metric):
+        frame = RarefactionFile(find_file(filename)).read_all_depths()
+        frame.insert(1, 'metric', metric)
+        return frame
+
+    with ThreadPoolExecutor(max_workers=len(files)) as pool:
+        frames = list(pool.map(summarise, files.keys(), files.values()))
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_depth_from_store(engine, metric, depth):
+    """Per-sample mean of one metric at one depth: an indexed lookup on (metric, depth)."""
+    frame = read_frame(
+        "SELECT sample_id, mean FROM alpha_rarefaction "
+        "WHERE metric = %(metric)s AND depth = %(depth)s",
+        engine, params={'metric': metric, 'depth': int(depth)},
+    )
+    return frame.rename(columns={'mean': metric})
+
+
+def read_curves_from_store(engine, metric, sample_ids):
+    """Full rarefaction (saturation) curves of one metric for a few samples."""
+    return read_frame(
+        "SELECT sample_id, depth, mean, std, n_iterations FROM alpha_rarefaction "
+        "WHERE metric = %(metric)s AND sample_id = ANY(%(ids)s) ORDER BY sample_id, depth",
+        engine, params={'metric': metric, 'ids': list(sample_ids)},
+    )
+
+
+if __name__ == "__main__":
+    from bulk_loader import copy_frame, report_progress
+    from data_access import get_engine
+
+    engine = get_engine()
+
+    print("--- Building the Alpha Rarefaction Store ---")
+    print("1. Summarising every depth of every curve...")
+    try:
+        store = build_store_frame()
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    for metric, group in store.groupby('metric'):
+        print(f"   -> {metric}: {group['sample_id'].nunique()} samples, "
+              f"depths {group['depth'].min()}-{group['depth'].max()}")
+
+    print(f"2. Loading {len(store)} rows into alpha_rarefaction...")
+    copy_frame(store, 'alpha_rarefaction', engine, if_exists='truncate', progress=report_progress)
+    print("--- Success! Any depth is now one indexed query away. ---")
@@ -0,0 +1,194 @@
+"""
+Pipeline runner: runs the project scripts as a dependency graph.
+
+Each stage declares its script, the data files it reads and writes, and the
+stages it depends on. Independent stages run in parallel (e.g. the BIOM
+extraction alongside the metadata ETL, all analysis scripts together after
+the loads). A stage is skipped when its fingerprint - the content of its
+inputs, its script and the local modules it imports, plus the fingerprints
+of its upstream stages - matches the last successful run. The stages that
+load the database also hash its creation stamp, so recreating the schema
+re-runs them (and everything downstream) without --force.
+
+Usage:
+    python run_pipeline.py                  # run everything that is out of date
+    python run_pipeline.py load_species     # one stage (and whatever it depends on)
+    python run_pipeline.py --force          # ignore the saved fingerprints
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from data_access import BACKEND, schema_stamp
+from etl_cache import file_fingerprint, local_modules
+
+STATE_FILE = '.pipeline_state.json'
+LOG_DIR = 'logs'
+
+RAREFACTION_FILES = ['data/shannon.txt', 'data/PD_whole_tree.txt', 'data/observed_otus.txt']
+
+# name: (script, inputs, outputs, depends on)
+STAGES = {
+    # Ingestion
+    'etl': ('etl_advanced.py', ['data/ag-cleaned.txt', 'data/drug_mapping.csv', 'data/PD_whole_tree.txt'], [], []),
+    'rarefaction_store': ('rarefaction.py', RAREFACTION_FILES, [], []),
+    'alpha_diversity': ('alpha_diversity.py', ['data/ag-gg-100nt.biom'], [], ['etl']),
+    'extract_species': ('extract_species.py', ['data/ag-gg-100nt.biom'],
+                        ['data/taxon_abundance.csv', 'data/species_counts.csv'], []),
+    'beta_diversity': ('beta_diversity.py', ['data/taxon_abundance.csv'], ['data/distances/braycurtis_genus.f32'],
+                       ['extract_species']),
+    'load_species': ('load_species.py', ['data/taxon_abundance.csv'], [], ['etl', 'extract_species']),
+    # Analysis & Modeling
+    'ml_gradient_boost': ('ml_gradient_boost.py', [], ['results/advanced_feature_importance.png'], ['alpha_diversity']),
+    'stats_new_targets': ('stats_new_targets.py', [], [], ['load_species']),
+    'permanova': ('permanova.py', [], ['results/permanova.csv'], ['load_species']),
+    'association_scan': ('association_scan.py', [], ['results/association_scan.csv'],
+                         ['load_species', 'alpha_diversity']),
+    'visualize_biomarkers': ('visualize_biomarkers.py', [], ['results/medical_biomarkers.png'], ['load_species']),
+    'visualize_species': ('visualize_species.py', [], ['results/species_comparison.png'], ['load_species']),
+    'visualize_lifestyle': ('visualize_lifestyle.py', [], ['results/lifestyle_analysis_cleaned.png'], ['alpha_diversity']),
+    'visualize_targeted_questions': ('visualize_targeted_questions.py', [], ['results/targeted_analysis.png'],
+                                     ['alpha_diversity']),
+}
+
+# Stages whose output is database tables rather than files
+DATABASE_STAGES = {'etl', 'rarefaction_store', 'alpha_diversity', 'load_species'}
+
+
+def stage_fingerprint(name, upstream, previous_files, database=None):
+    """Hash of the stage's code, inputs and upstream fingerprints (file hashes reused when mtime is unchanged)."""
+    script, inputs, _, deps = STAGES[name]
+    digest = hashlib.blake2b(digest_size=16)
+    files = {}
+    for path in sorted(local_modules(script)) + sorted(inputs):
+        if os.path.exists(path):
+            files[path] = file_fingerprint(path, previous_files.get(path))
+            digest.update(f"{path}:{files[path]['hash']};".encode())
+        else:
+            digest.update(f"{path}:missing;".encode())
+    for dep in sorted(deps):
+        digest.update(f"{dep}:{upstream[dep]};".encode())
+    digest.update(f"backend:{BACKEND};".encode())  # switching backends re-runs every stage
+    if name in DATABASE_STAGES:
+        digest.update(f"database:{database};".encode())  # a reset database is reloaded
+    return digest.hexdigest(), files
+
+
+def run_stage(name):
+    """Runs one script in its own interpreter; output goes to logs/<stage>.log."""
+    script = STAGES[name][0]
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, script], capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(LOG_DIR, f'{name}.log'), 'w') as f:
+        f.write(result.stdout)
+        f.write(result.stderr)
+    return result.returncode, elapsed, result.stdout + result.stderr
+
+
+def with_dependencies(names):
+    """The requested stages plus everything upstream of them."""
+    selected, todo = set(), list(names)
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo.extend(STAGES[name][3])
+    return selected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the microbiome pipeline stages in dependency order.")
+    parser.add_argument('stages', nargs='*', help=f"stages to run (default: all). Choices: {', '.join(STAGES)}")
+    parser.add_argument('--force', action='store_true', help="re-run stages even if their inputs are unchanged")
+    parser.add_argument('--jobs', type=int, default=max(4, os.cpu_count() or 1), help="maximum stages running at once")
+    args = parser.parse_args()
+
+    unknown = [s for s in args.stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+    if BACKEND == 'duckdb' and args.jobs > 1:
+        # The embedded database file takes one writing process at a time
+        print("   (MICROBIOME_BACKEND=duckdb: running stages one at a time)")
+        args.jobs = 1
+    selected = with_dependencies(args.stages) if args.stages else set(STAGES)
+
+    try:
+        with open(STATE_FILE) as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        state = {'stages': {}, 'files': {}}
+    os.makedirs(LOG_DIR, exist_ok=True)
+    database = schema_stamp()
+
+    print(f"--- Running Pipeline ({len(selected)} stages, up to {args.jobs} in parallel) ---")
+    fingerprints, status, timings = {}, {}, {}
+    pipeline_start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        running = {}
+        while True:
+            # Schedule every stage whose dependencies have finished
+            for name in STAGES:
+                if name not in selected or name in status or name in running.values():
+                    continue
+                deps = STAGES[name][3]
+                if any(status.get(d) in ('failed', 'blocked') for d in deps):
+                    status[name] = 'blocked'
+                    print(f"   [blocked] {name} (upstream failure)")
+                    continue
+                if not all(status.get(d) in ('ran', 'skipped') for d in deps if d in selected):
+                    continue
+
+                # Stages outside the selection count as up to date
+                upstream = {d: fingerprints.get(d, state['stages'].get(d, '')) for d in deps}
+                fingerprints[name], files = stage_fingerprint(name, upstream, state['files'], database)
+                state['files'].update(files)
+                outputs_exist = all(os.path.exists(p) for p in STAGES[name][2])
+                if not args.force and outputs_exist and state['stages'].get(name) == fingerprints[name]:
+                    status[name], timings[name] = 'skipped', 0.0
+                    print(f"   [skip]    {name} (inputs unchanged)")
+                    continue
+
+                print(f"   [start]   {name}")
+                running[pool.submit(run_stage, name)] = name
+
+            if not running:
+                if all(name in status for name in selected):
+                    break
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                code, elapsed, output = future.result()
+                timings[name] = elapsed
+                if code == 0:
+                    status[name] = 'ran'
+                    print(f"   [done]    {name} ({elapsed:.1f}s)")
+                    # Save after every stage so an interrupted run keeps its progress
+                    state['stages'][name] = fingerprints[name]
+                    with open(STATE_FILE, 'w') as f:
+                        json.dump(state, f, indent=2)
+                else:
+                    status[name] = 'failed'
+                    print(f"   [FAILED]  {name} ({elapsed:.1f}s), last lines of {LOG_DIR}/{name}.log:")
+                    print('\n'.join('      ' + line for line in output.strip().splitlines()[-10:]))
+
+    # Timing summary
+    print("\n--- Stage Summary ---")
+    for name in STAGES:
+        if name in status:
+            print(f"   {name:<30} {status[name]:<8} {timings.get(name, 0.0):>7.1f}s")
+    print(f"   {'total (wall clock)':<30} {'':<8} {time.perf_counter() - pipeline_start:>7.1f}s")
+
+    sys.exit(1 if any(s in ('failed', 'blocked') for s in status.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,172 @@
 -- 1. Clean Slate
+DROP TABLE IF EXISTS cohort_members;
+DROP TABLE IF EXISTS cohort_stats;
+DROP TABLE IF EXISTS quarantine;
+DROP TABLE IF EXISTS etl_row_hashes;
+DROP TABLE IF EXISTS table_versions;
+DROP TABLE IF EXISTS alpha_rarefaction;
+DROP TABLE IF EXISTS patient_medications;
+DROP MATERIALIZED VIEW IF EXISTS analysis_samples;
+-- `key_species` and `samples` are views (older databases still have them as tables)
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'key_species' AND relkind = 'v') THEN
+        DROP VIEW key_species;
+    END IF;
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'samples' AND relkind = 'v') THEN
+        DROP VIEW samples;
+    END IF;
+END $$;
 DROP TABLE IF EXISTS key_species;
+DROP TABLE IF EXISTS taxon_abundance;
 DROP TABLE IF EXISTS gut_metrics;
 DROP TABLE IF EXISTS samples CASCADE;
+DROP TABLE IF EXISTS samples_coded CASCADE;
+DROP TABLE IF EXISTS category_labels;
 
--- 2. Patient Dimension Table (Demographics + Diet + Lifestyle + Polypharmacy)
-CREATE TABLE samples (
+-- 2. Category Dictionary (each distinct survey answer stored once, referenced by a small-integer code)
+-- Populated by the ETL as new labels appear
+CREATE TABLE category_labels (
+    code SMALLINT PRIMARY KEY,
+    label VARCHAR(100) UNIQUE NOT NULL
+);
+
+-- 3. Patient Dimension Table (Demographics + Diet + Lifestyle + Polypharmacy)
+-- The frequency/lifestyle answers are dictionary-encoded codes into category_labels
+CREATE TABLE samples_coded (
     sample_id VARCHAR(50) PRIMARY KEY,
     age NUMERIC,
     sex VARCHAR(20),
     bmi NUMERIC,
     country VARCHAR(50),
+    antibiotic_history SMALLINT REFERENCES category_labels(code),
+    diet_type SMALLINT REFERENCES category_labels(code),
+    plant_types_count NUMERIC,
+    alcohol_freq SMALLINT REFERENCES category_labels(code),
+    red_meat_freq SMALLINT REFERENCES category_labels(code),
+    -- Polypharmacy Columns
+    probiotic_freq SMALLINT REFERENCES category_labels(code),
+    vitamin_b_freq SMALLINT REFERENCES category_labels(code),
+    vitamin_d_freq SMALLINT REFERENCES category_labels(code),
+    multivitamin_freq SMALLINT REFERENCES category_labels(code),
+    acne_med_freq SMALLINT REFERENCES category_labels(code)
+);
+
+-- 4. Lab Metrics Fact Table
+CREATE TABLE gut_metrics (
+    sample_id VARCHAR(50) PRIMARY KEY REFERENCES samples_coded(sample_id),
+    shannon_entropy NUMERIC,
+    phylogenetic_diversity NUMERIC,
+    species_count NUMERIC,
+    simpson NUMERIC,          -- from alpha_diversity.py
+    chao1 NUMERIC             -- from alpha_diversity.py
+);
+
+-- 5. Taxonomy Fact Table (counts at every rank, phylum through genus)
+-- Long format, non-zero entries only: any taxon can be queried without schema changes
+CREATE TABLE taxon_abundance (
+    sample_id VARCHAR(50) REFERENCES samples_coded(sample_id),
+    rank VARCHAR(10),
+    taxon VARCHAR(200),
+    count INTEGER,
+    rel_abundance REAL,   -- count / total reads of the sample
+    PRIMARY KEY (sample_id, rank, taxon)
+);
+CREATE INDEX idx_taxon_abundance_rank_taxon ON taxon_abundance (rank, taxon);
+
+-- 6. Medication Fact Table (Polypharmacy, parsed from the free-text medication answers)
+CREATE TABLE patient_medications (
+    sample_id VARCHAR(50) REFERENCES samples_coded(sample_id),
+    generic_name VARCHAR(100),
+    drug_class VARCHAR(50),
+    PRIMARY KEY (sample_id, generic_name, drug_class)
+);
+
+-- 7. ETL Bookkeeping (per-sample row hashes for incremental loads, table load counters)
+CREATE TABLE etl_row_hashes (
+    table_name VARCHAR(50),
+    sample_id VARCHAR(50),
+    row_hash BIGINT,
+    PRIMARY KEY (table_name, sample_id)
+);
+
+-- Load counter per table, bumped by bulk_loader; keys data_access.query()'s result cache
+CREATE TABLE table_versions (
+    table_name VARCHAR(63) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT now()
+);
+-- Creation stamp of this database: run_pipeline.py re-runs the loading stages when it changes
+INSERT INTO table_versions (table_name) VALUES ('schema');
+
+-- 8. Alpha Rarefaction Store (every depth of every curve, long format)
+-- Includes controls/BLANKs and samples outside `samples`, hence no foreign key
+CREATE TABLE alpha_rarefaction (
+    sample_id VARCHAR(50),
+    metric VARCHAR(30),
+    depth INTEGER,
+    mean DOUBLE PRECISION,
+    std DOUBLE PRECISION,
+    n_iterations SMALLINT,
+    PRIMARY KEY (sample_id, metric, depth)
+);
+CREATE INDEX idx_alpha_rarefaction_metric_depth ON alpha_rarefaction (metric, depth);
+
+-- 9. Quarantine (rows rejected by the ETL validation rules, see validation.py)
+CREATE TABLE quarantine (
+    source VARCHAR(30),          -- table the row was meant for
+    sample_id VARCHAR(50),
+    reason TEXT,                 -- '; '-separated names of the failed rules
+    record JSONB,                -- the row as it was read
+    quarantined_at TIMESTAMP DEFAULT now()
+);
+CREATE INDEX idx_quarantine_source ON quarantine (source);
+
+-- 10. Cohort Statistics (streaming per-group accumulators, maintained by accumulators.py)
+-- Count, mean and M2 (sum of squared deviations from the mean) of every metric per level of every cohort
+CREATE TABLE cohort_stats (
+    cohort VARCHAR(100),         -- analysis_samples column, or '+'-joined columns for a crossed cohort
+    level VARCHAR(250),          -- its value(s), ' | '-joined
+    metric VARCHAR(63),
+    n BIGINT NOT NULL,
+    mean DOUBLE PRECISION NOT NULL,
+    m2 DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (cohort, level, metric)
+);
+
+-- The analysis_samples values each sample currently contributes to cohort_stats; the next
+-- update subtracts these and adds the new ones. Columns follow accumulators.COHORTS / METRICS.
+CREATE TABLE cohort_members (
+    sample_id VARCHAR(50) PRIMARY KEY,
+    sex VARCHAR(20),
+    country VARCHAR(50),
     antibiotic_history VARCHAR(100),
     diet_type VARCHAR(100),
-    plant_types_count NUMERIC,
     alcohol_freq VARCHAR(100),
     red_meat_freq VARCHAR(100),
-    -- Polypharmacy Columns
     probiotic_freq VARCHAR(100),
     vitamin_b_freq VARCHAR(100),
     vitamin_d_freq VARCHAR(100),
     multivitamin_freq VARCHAR(100),
-    acne_med_freq VARCHAR(100)
+    acne_med_freq VARCHAR(100),
+    bmi_group VARCHAR(20),
+    diet_group VARCHAR(20),
+    abx_group VARCHAR(20),
+    prevotella DOUBLE PRECISION,
+    bacteroides DOUBLE PRECISION,
+    roseburia DOUBLE PRECISION,
+    bifidobacterium DOUBLE PRECISION,
+    alistipes DOUBLE PRECISION,
+    akkermansia DOUBLE PRECISION,
+    faecalibacterium DOUBLE PRECISION,
+    lactobacillus DOUBLE PRECISION,
+    pb_ratio DOUBLE PRECISION,
+    shannon_entropy DOUBLE PRECISION,
+    phylogenetic_diversity DOUBLE PRECISION,
+    species_count DOUBLE PRECISION,
+    simpson DOUBLE PRECISION,
+    chao1 DOUBLE PRECISION
 );
 
--- 3. Lab Metrics Fact Table
-CREATE TABLE gut_metrics (
-    sample_id VARCHAR(50) PRIMARY KEY REFERENCES samples(sample_id),
-    shannon_entropy NUMERIC,
-    phylogenetic_diversity NUMERIC,
-    species_count NUMERIC
-);
-
--- 4. Taxonomy Fact Table (Key Biomarkers)
-CREATE TABLE key_species (
-    sample_id VARCHAR(50) PRIMARY KEY REFERENCES samples(sample_id),
-    prevotella NUMERIC,
-    bacteroides NUMERIC,
-    roseburia NUMERIC,
-    bifidobacterium NUMERIC,
-    alistipes NUMERIC,
-    akkermansia NUMERIC,
-    faecalibacterium NUMERIC,
-    lactobacillus NUMERIC
-);
\ No newline at end of file
+-- 11. Views and the analysis_samples materialized view (kept in their own file so the loaders can re-create them after swapping a table in)
+\ir schema_views.sql
@@ -0,0 +1,255 @@
+-- Embedded (DuckDB) version of schema_creation.sql + schema_views.sql, used with
+-- MICROBIOME_BACKEND=duckdb. Same tables, columns and views; keep the two in sync.
+-- Differences: NUMERIC is DOUBLE (DuckDB's NUMERIC is DECIMAL(18,3) and would round
+-- the metrics), JSONB is VARCHAR, there are no foreign keys (the loaders drop
+-- orphans themselves) or secondary indexes (DuckDB scans columns with min/max
+-- zone maps instead), and analysis_samples is a table rebuilt by
+-- bulk_loader.refresh_views() from the analysis_samples_source view.
+
+-- 1. Clean Slate
+DROP TABLE IF EXISTS analysis_samples;
+DROP VIEW IF EXISTS analysis_samples_source;
+DROP VIEW IF EXISTS key_species;
+DROP VIEW IF EXISTS samples;
+DROP TABLE IF EXISTS cohort_members;
+DROP TABLE IF EXISTS cohort_stats;
+DROP TABLE IF EXISTS quarantine;
+DROP TABLE IF EXISTS etl_row_hashes;
+DROP TABLE IF EXISTS table_versions;
+DROP TABLE IF EXISTS alpha_rarefaction;
+DROP TABLE IF EXISTS patient_medications;
+DROP TABLE IF EXISTS taxon_abundance;
+DROP TABLE IF EXISTS gut_metrics;
+DROP TABLE IF EXISTS samples_coded;
+DROP TABLE IF EXISTS category_labels;
+
+-- 2. Category Dictionary
+CREATE TABLE category_labels (
+    code SMALLINT PRIMARY KEY,
+    label VARCHAR(100) UNIQUE NOT NULL
+);
+
+-- 3. Patient Dimension Table
+CREATE TABLE samples_coded (
+    sample_id VARCHAR(50) PRIMARY KEY,
+    age DOUBLE,
+    sex VARCHAR(20),
+    bmi DOUBLE,
+    country VARCHAR(50),
+    antibiotic_history SMALLINT,
+    diet_type SMALLINT,
+    plant_types_count DOUBLE,
+    alcohol_freq SMALLINT,
+    red_meat_freq SMALLINT,
+    probiotic_freq SMALLINT,
+    vitamin_b_freq SMALLINT,
+    vitamin_d_freq SMALLINT,
+    multivitamin_freq SMALLINT,
+    acne_med_freq SMALLINT
+);
+
+-- 4. Lab Metrics Fact Table
+CREATE TABLE gut_metrics (
+    sample_id VARCHAR(50) PRIMARY KEY,
+    shannon_entropy DOUBLE,
+    phylogenetic_diversity DOUBLE,
+    species_count DOUBLE,
+    simpson DOUBLE,
+    chao1 DOUBLE
+);
+
+-- 5. Taxonomy Fact Table
+CREATE TABLE taxon_abundance (
+    sample_id VARCHAR(50),
+    rank VARCHAR(10),
+    taxon VARCHAR(200),
+    count INTEGER,
+    rel_abundance REAL,
+    PRIMARY KEY (sample_id, rank, taxon)
+);
+
+-- 6. Medication Fact Table
+CREATE TABLE patient_medications (
+    sample_id VARCHAR(50),
+    generic_name VARCHAR(100),
+    drug_class VARCHAR(50),
+    PRIMARY KEY (sample_id, generic_name, drug_class)
+);
+
+-- 7. ETL Bookkeeping
+CREATE TABLE etl_row_hashes (
+    table_name VARCHAR(50),
+    sample_id VARCHAR(50),
+    row_hash BIGINT,
+    PRIMARY KEY (table_name, sample_id)
+);
+
+CREATE TABLE table_versions (
+    table_name VARCHAR(63) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT now()
+);
+-- Creation stamp of this database: run_pipeline.py re-runs the loading stages when it changes
+INSERT INTO table_versions (table_name) VALUES ('schema');
+
+-- 8. Alpha Rarefaction Store
+CREATE TABLE alpha_rarefaction (
+    sample_id VARCHAR(50),
+    metric VARCHAR(30),
+    depth INTEGER,
+    mean DOUBLE,
+    std DOUBLE,
+    n_iterations SMALLINT,
+    PRIMARY KEY (sample_id, metric, depth)
+);
+
+-- 9. Quarantine
+CREATE TABLE quarantine (
+    source VARCHAR(30),
+    sample_id VARCHAR(50),
+    reason VARCHAR,
+    record VARCHAR,
+    quarantined_at TIMESTAMP DEFAULT now()
+);
+
+-- 10. Cohort Statistics (streaming per-group accumulators, maintained by accumulators.py)
+-- Count, mean and M2 (sum of squared deviations from the mean) of every metric per level of every cohort
+CREATE TABLE cohort_stats (
+    cohort VARCHAR(100),         -- analysis_samples column, or '+'-joined columns for a crossed cohort
+    level VARCHAR(250),          -- its value(s), ' | '-joined
+    metric VARCHAR(63),
+    n BIGINT NOT NULL,
+    mean DOUBLE NOT NULL,
+    m2 DOUBLE NOT NULL,
+    PRIMARY KEY (cohort, level, metric)
+);
+
+-- The analysis_samples values each sample currently contributes to cohort_stats; the next
+-- update subtracts these and adds the new ones. Columns follow accumulators.COHORTS / METRICS.
+CREATE TABLE cohort_members (
+    sample_id VARCHAR(50) PRIMARY KEY,
+    sex VARCHAR(20),
+    country VARCHAR(50),
+    antibiotic_history VARCHAR(100),
+    diet_type VARCHAR(100),
+    alcohol_freq VARCHAR(100),
+    red_meat_freq VARCHAR(100),
+    probiotic_freq VARCHAR(100),
+    vitamin_b_freq VARCHAR(100),
+    vitamin_d_freq VARCHAR(100),
+    multivitamin_freq VARCHAR(100),
+    acne_med_freq VARCHAR(100),
+    bmi_group VARCHAR(20),
+    diet_group VARCHAR(20),
+    abx_group VARCHAR(20),
+    prevotella DOUBLE,
+    bacteroides DOUBLE,
+    roseburia DOUBLE,
+    bifidobacterium DOUBLE,
+    alistipes DOUBLE,
+    akkermansia DOUBLE,
+    faecalibacterium DOUBLE,
+    lactobacillus DOUBLE,
+    pb_ratio DOUBLE,
+    shannon_entropy DOUBLE,
+    phylogenetic_diversity DOUBLE,
+    species_count DOUBLE,
+    simpson DOUBLE,
+    chao1 DOUBLE
+);
+
+-- 11. Views
+CREATE VIEW samples AS
+SELECT
+    s.sample_id,
+    s.age,
+    s.sex,
+    s.bmi,
+    s.country,
+    abx.label AS antibiotic_history,
+    diet.label AS diet_type,
+    s.plant_types_count,
+    alc.label AS alcohol_freq,
+    meat.label AS red_meat_freq,
+    pro.label AS probiotic_freq,
+    vb.label AS vitamin_b_freq,
+    vd.label AS vitamin_d_freq,
+    multi.label AS multivitamin_freq,
+    acne.label AS acne_med_freq,
+    -- The compact codes themselves, for filters and GROUP BYs that need no label
+    s.antibiotic_history AS antibiotic_history_code,
+    s.diet_type AS diet_type_code,
+    s.alcohol_freq AS alcohol_freq_code,
+    s.red_meat_freq AS red_meat_freq_code,
+    s.probiotic_freq AS probiotic_freq_code,
+    s.vitamin_b_freq AS vitamin_b_freq_code,
+    s.vitamin_d_freq AS vitamin_d_freq_code,
+    s.multivitamin_freq AS multivitamin_freq_code,
+    s.acne_med_freq AS acne_med_freq_code
+FROM samples_coded s
+LEFT JOIN category_labels abx ON abx.code = s.antibiotic_history
+LEFT JOIN category_labels diet ON diet.code = s.diet_type
+LEFT JOIN category_labels alc ON alc.code = s.alcohol_freq
+LEFT JOIN category_labels meat ON meat.code = s.red_meat_freq
+LEFT JOIN category_labels pro ON pro.code = s.probiotic_freq
+LEFT JOIN category_labels vb ON vb.code = s.vitamin_b_freq
+LEFT JOIN category_labels vd ON vd.code = s.vitamin_d_freq
+LEFT JOIN category_labels multi ON multi.code = s.multivitamin_freq
+LEFT JOIN category_labels acne ON acne.code = s.acne_med_freq;
+
+CREATE VIEW key_species AS
+SELECT
+    sample_id,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Prevotella'), 0)::DOUBLE AS prevotella,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Bacteroides'), 0)::DOUBLE AS bacteroides,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Roseburia'), 0)::DOUBLE AS roseburia,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Bifidobacterium'), 0)::DOUBLE AS bifidobacterium,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Alistipes'), 0)::DOUBLE AS alistipes,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Akkermansia'), 0)::DOUBLE AS akkermansia,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Faecalibacterium'), 0)::DOUBLE AS faecalibacterium,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Lactobacillus'), 0)::DOUBLE AS lactobacillus
+FROM taxon_abundance
+GROUP BY sample_id;
+
+CREATE VIEW analysis_samples_source AS
+SELECT
+    s.*,
+    -- The core lab metrics all present: the ETL loads phylogenetic diversity, alpha_diversity.py
+    -- Shannon and observed features (samples below its depth have none)
+    m.shannon_entropy IS NOT NULL AND m.phylogenetic_diversity IS NOT NULL AND m.species_count IS NOT NULL AS has_metrics,
+    m.shannon_entropy,
+    m.phylogenetic_diversity,
+    m.species_count,
+    m.simpson,
+    m.chao1,
+    k.sample_id IS NOT NULL AS has_taxa,
+    k.prevotella,
+    k.bacteroides,
+    k.roseburia,
+    k.bifidobacterium,
+    k.alistipes,
+    k.akkermansia,
+    k.faecalibacterium,
+    k.lactobacillus,
+    k.prevotella / NULLIF(k.bacteroides, 0) AS pb_ratio,
+    CASE
+        WHEN s.bmi < 18.5 THEN 'Underweight'
+        WHEN s.bmi < 25 THEN 'Normal'
+        WHEN s.bmi < 30 THEN 'Overweight'
+        WHEN s.bmi IS NOT NULL THEN 'Obese'
+    END AS bmi_group,
+    CASE
+        WHEN s.diet_type = 'Vegan' THEN 'Vegan'
+        WHEN s.diet_type = 'Omnivore' AND s.red_meat_freq IN ('Rarely (less than once/week)', 'Occasionally (1-2 times/week)') THEN 'Moderate'
+        WHEN s.diet_type = 'Omnivore' AND s.red_meat_freq IN ('Daily', 'Regularly (3-5 times/week)') THEN 'High_Meat'
+    END AS diet_group,
+    CASE
+        WHEN s.antibiotic_history IN ('Week', 'Month') THEN 'Recent'
+        WHEN s.antibiotic_history IN ('6 months', 'Year') THEN 'Past_Year'
+        WHEN s.antibiotic_history = 'I have not taken antibiotics in the past year.' THEN 'None'
+    END AS abx_group
+FROM samples s
+LEFT JOIN gut_metrics m ON m.sample_id = s.sample_id
+LEFT JOIN key_species k ON k.sample_id = s.sample_id;
+
+CREATE TABLE analysis_samples AS SELECT * FROM analysis_samples_source;
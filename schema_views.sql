@@ -0,0 +1,118 @@
+-- View definitions, idempotent (CREATE OR REPLACE / IF NOT EXISTS).
+-- Included by schema_creation.sql and re-applied by bulk_loader.swap_table()
+-- after a table the views read from has been swapped in.
+
+-- Same columns and labels as the original `samples` table, so existing queries keep working,
+-- followed by the SMALLINT codes (category_codes.code_filter() matches labels against them)
+CREATE OR REPLACE VIEW samples AS
+SELECT
+    s.sample_id,
+    s.age,
+    s.sex,
+    s.bmi,
+    s.country,
+    abx.label AS antibiotic_history,
+    diet.label AS diet_type,
+    s.plant_types_count,
+    alc.label AS alcohol_freq,
+    meat.label AS red_meat_freq,
+    pro.label AS probiotic_freq,
+    vb.label AS vitamin_b_freq,
+    vd.label AS vitamin_d_freq,
+    multi.label AS multivitamin_freq,
+    acne.label AS acne_med_freq,
+    -- The compact codes themselves, for filters and GROUP BYs that need no label
+    s.antibiotic_history AS antibiotic_history_code,
+    s.diet_type AS diet_type_code,
+    s.alcohol_freq AS alcohol_freq_code,
+    s.red_meat_freq AS red_meat_freq_code,
+    s.probiotic_freq AS probiotic_freq_code,
+    s.vitamin_b_freq AS vitamin_b_freq_code,
+    s.vitamin_d_freq AS vitamin_d_freq_code,
+    s.multivitamin_freq AS multivitamin_freq_code,
+    s.acne_med_freq AS acne_med_freq_code
+FROM samples_coded s
+LEFT JOIN category_labels abx ON abx.code = s.antibiotic_history
+LEFT JOIN category_labels diet ON diet.code = s.diet_type
+LEFT JOIN category_labels alc ON alc.code = s.alcohol_freq
+LEFT JOIN category_labels meat ON meat.code = s.red_meat_freq
+LEFT JOIN category_labels pro ON pro.code = s.probiotic_freq
+LEFT JOIN category_labels vb ON vb.code = s.vitamin_b_freq
+LEFT JOIN category_labels vd ON vd.code = s.vitamin_d_freq
+LEFT JOIN category_labels multi ON multi.code = s.multivitamin_freq
+LEFT JOIN category_labels acne ON acne.code = s.acne_med_freq;
+
+-- Key Biomarkers: the keystone genera as columns (0 where the genus was not observed)
+CREATE OR REPLACE VIEW key_species AS
+SELECT
+    sample_id,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Prevotella'), 0)::NUMERIC AS prevotella,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Bacteroides'), 0)::NUMERIC AS bacteroides,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Roseburia'), 0)::NUMERIC AS roseburia,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Bifidobacterium'), 0)::NUMERIC AS bifidobacterium,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Alistipes'), 0)::NUMERIC AS alistipes,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Akkermansia'), 0)::NUMERIC AS akkermansia,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Faecalibacterium'), 0)::NUMERIC AS faecalibacterium,
+    COALESCE(SUM(count) FILTER (WHERE rank = 'genus' AND taxon = 'Lactobacillus'), 0)::NUMERIC AS lactobacillus
+FROM taxon_abundance
+GROUP BY sample_id;
+
+-- Analysis-ready wide table: one row per sample with its survey answers, lab
+-- metrics and key genera, and the cohort buckets the analysis scripts group by.
+-- Refreshed by the loaders (bulk_loader.refresh_views) after every load.
+CREATE MATERIALIZED VIEW IF NOT EXISTS analysis_samples AS
+SELECT
+    s.*,
+    -- The core lab metrics all present: the ETL loads phylogenetic diversity, alpha_diversity.py
+    -- Shannon and observed features (samples below its depth have none)
+    m.shannon_entropy IS NOT NULL AND m.phylogenetic_diversity IS NOT NULL AND m.species_count IS NOT NULL AS has_metrics,
+    m.shannon_entropy,
+    m.phylogenetic_diversity,
+    m.species_count,
+    m.simpson,
+    m.chao1,
+    k.sample_id IS NOT NULL AS has_taxa,
+    k.prevotella,
+    k.bacteroides,
+    k.roseburia,
+    k.bifidobacterium,
+    k.alistipes,
+    k.akkermansia,
+    k.faecalibacterium,
+    k.lactobacillus,
+    k.prevotella / NULLIF(k.bacteroides, 0) AS pb_ratio,
+    -- WHO categories
+    CASE
+        WHEN s.bmi < 18.5 THEN 'Underweight'
+        WHEN s.bmi < 25 THEN 'Normal'
+        WHEN s.bmi < 30 THEN 'Overweight'
+        WHEN s.bmi IS NOT NULL THEN 'Obese'
+    END AS bmi_group,
+    CASE
+        WHEN s.diet_type = 'Vegan' THEN 'Vegan'
+        WHEN s.diet_type = 'Omnivore' AND s.red_meat_freq IN ('Rarely (less than once/week)', 'Occasionally (1-2 times/week)') THEN 'Moderate'
+        WHEN s.diet_type = 'Omnivore' AND s.red_meat_freq IN ('Daily', 'Regularly (3-5 times/week)') THEN 'High_Meat'
+    END AS diet_group,
+    CASE
+        WHEN s.antibiotic_history IN ('Week', 'Month') THEN 'Recent'
+        WHEN s.antibiotic_history IN ('6 months', 'Year') THEN 'Past_Year'
+        WHEN s.antibiotic_history = 'I have not taken antibiotics in the past year.' THEN 'None'
+    END AS abx_group
+FROM samples s
+LEFT JOIN gut_metrics m ON m.sample_id = s.sample_id
+LEFT JOIN key_species k ON k.sample_id = s.sample_id;
+
+-- Unique key (lets REFRESH ... CONCURRENTLY keep the view readable) and the cohort filters
+CREATE UNIQUE INDEX IF NOT EXISTS idx_analysis_samples_id ON analysis_samples (sample_id);
+CREATE INDEX IF NOT EXISTS idx_analysis_samples_abx ON analysis_samples (antibiotic_history_code);
+CREATE INDEX IF NOT EXISTS idx_analysis_samples_diet ON analysis_samples (diet_type_code);
+CREATE INDEX IF NOT EXISTS idx_analysis_samples_bmi ON analysis_samples (bmi);
+CREATE INDEX IF NOT EXISTS idx_analysis_samples_sex ON analysis_samples (sex);
+-- Partial indexes for the recurring cohorts: genus-level tests group the samples
+-- with taxa by BMI / diet, the diversity plots the samples with lab metrics by antibiotics
+CREATE INDEX IF NOT EXISTS idx_analysis_samples_bmi_group ON analysis_samples (bmi_group) WHERE has_taxa AND bmi_group IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_analysis_samples_diet_group ON analysis_samples (diet_group) WHERE has_taxa AND diet_group IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_analysis_samples_abx_group ON analysis_samples (abx_group) WHERE has_metrics AND abx_group IS NOT NULL;
+-- The recommender / gradient-boosting cohort: complete demographics with lab metrics
+CREATE INDEX IF NOT EXISTS idx_analysis_samples_profiled ON analysis_samples (sex, age)
+    WHERE has_metrics AND bmi > 0 AND plant_types_count IS NOT NULL;
@@ -0,0 +1,64 @@
+"""
+Group comparisons from aggregates computed in the database.
+
+A Welch t-test only needs each group's size, mean and variance. group_stats()
+has the database compute them (count, sum, var_samp per group) and returns
+one row per group, so a test costs the same few bytes whether the groups hold
+a hundred samples or a million. welch_ttest() derives the t-statistic,
+Welch-Satterthwaite degrees of freedom and p-value from two such rows; the
+result equals scipy's ttest_ind(..., equal_var=False) on the raw values.
+
+Rank-based tests cannot be reduced to per-group aggregates; group_values()
+pulls the (group, value) rows those still need.
+
+    stats = sql_stats.group_stats('akkermansia', 'bmi_group',
+                                  where="has_taxa AND bmi_group IN ('Normal', 'Obese')")
+    t_stat, df, p_val = sql_stats.welch_ttest(stats.loc['Normal'], stats.loc['Obese'])
+"""
+import numpy as np
+from scipy.stats import t
+
+import data_access
+
+
+def group_stats(value, group, table='analysis_samples', where=None, params=None, engine=None):
+    """
+    n, sum, mean and sample variance of the `value` expression per value of
+    the `group` expression, computed by the database; NULL values are left
+    out, like the NaNs ttest_ind would have to be given without. Indexed by group.
+    """
+    # var_samp rather than a sum of squares: the database computes it without
+    # the cancellation that n * mean^2 vs. sum(x^2) suffers for large counts
+    sql = f"""
+    SELECT {group} AS "group",
+           count(*) AS n,
+           sum(CAST({value} AS DOUBLE PRECISION)) AS sum,
+           var_samp(CAST({value} AS DOUBLE PRECISION)) AS var
+    FROM {table}
+    WHERE {value} IS NOT NULL{f' AND ({where})' if where else ''}
+    GROUP BY 1
+    ORDER BY 1
+    """
+    stats = data_access.query(sql, engine, params, dtypes={'group': 'string'}).set_index('group')
+    stats.insert(2, 'mean', stats['sum'] / stats['n'])
+    return stats
+
+
+def welch_ttest(a, b):
+    """(t, degrees of freedom, two-sided p) of Welch's t-test between two group_stats() rows."""
+    se2_a, se2_b = a['var'] / a['n'], b['var'] / b['n']
+    se2 = se2_a + se2_b
+    t_stat = (a['mean'] - b['mean']) / np.sqrt(se2)
+    df = se2 ** 2 / (se2_a ** 2 / (a['n'] - 1) + se2_b ** 2 / (b['n'] - 1))
+    return t_stat, df, 2 * t.sf(abs(t_stat), df)
+
+
+def group_values(value, group, table='analysis_samples', where=None, params=None, engine=None):
+    """The non-NULL values per group as {group: array}, for rank-based tests (Mann-Whitney, Kruskal-Wallis)."""
+    sql = f"""
+    SELECT {group} AS "group", {value} AS value
+    FROM {table}
+    WHERE {value} IS NOT NULL{f' AND ({where})' if where else ''}
+    """
+    df = data_access.query(sql, engine, params, dtypes={'group': 'string'})
+    return {name: values.to_numpy() for name, values in df.groupby('group')['value']}
@@ -0,0 +1,120 @@
+"""
+Taxonomy index for the observations of a BIOM table.
+
+The Greengenes taxonomy strings ('k__Bacteria', ..., 'g__Akkermansia', 's__')
+are parsed once per BIOM file into one integer code per observation and rank,
+plus the list of names for each rank. The arrays are cached in data/cache/
+next to the fingerprint of the BIOM file, so later runs skip the parsing.
+Resolving taxa to observations is then an array lookup on exact rank names
+('g__Prevotella' does not match 'g__[Prevotella]').
+"""
+import json
+import os
+
+import h5py
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from etl_cache import CACHE_DIR, file_fingerprint
+
+RANKS = ['kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+UNASSIGNED = -1  # code for an empty rank ('g__') or a missing one
+
+
+def read_taxonomy(path):
+    """(observation ids, n_observations x 7 array of taxonomy strings) from a BIOM file."""
+    try:
+        # HDF5 BIOM (2.x): the taxonomy is one string dataset, no per-observation Python calls
+        with h5py.File(path, 'r') as f:
+            ids = f['observation/ids'][:].astype(str)
+            taxonomy = f['observation/metadata/taxonomy'][:].astype(str)
+    except (OSError, KeyError):
+        # JSON BIOM, or an HDF5 file without taxonomy in that place: go through the biom package
+        import biom
+        table = biom.load_table(path)
+        ids = np.asarray(table.ids(axis='observation'), dtype=str)
+        metadata = table.metadata(axis='observation') or [None] * len(ids)
+        taxonomy = pd.DataFrame([(m or {}).get('taxonomy', []) for m in metadata]).fillna('').to_numpy(dtype=str)
+
+    # Pad short lineages so every row has the 7 ranks
+    taxonomy = np.atleast_2d(taxonomy)
+    if taxonomy.shape[1] < len(RANKS):
+        padding = np.full((taxonomy.shape[0], len(RANKS) - taxonomy.shape[1]), '', dtype=str)
+        taxonomy = np.hstack([taxonomy, padding])
+    return ids, taxonomy[:, :len(RANKS)]
+
+
+def indicator_matrix(assignment, n_groups, dtype=np.float32):
+    """
+    Sparse n_groups x n_observations matrix with a 1 where observation j
+    belongs to group i (assignment[j] == i; -1 rows are left out).
+    Multiplying it with the observation x sample counts collapses them per group.
+    """
+    members = np.flatnonzero(assignment >= 0)
+    return sparse.csr_matrix(
+        (np.ones(len(members), dtype=dtype), (assignment[members], members)),
+        shape=(n_groups, len(assignment)),
+    )
+
+
+class TaxonomyIndex:
+    """Observation index -> integer-coded kingdom ... species, with the names per rank."""
+
+    def __init__(self, observation_ids, codes, names):
+        self.observation_ids = observation_ids  # (n_obs,) str
+        self.codes = codes                      # (n_obs, 7) int32, UNASSIGNED where empty
+        self.names = names                      # rank -> array of names (without the 'g__' prefix)
+
+    @classmethod
+    def from_biom(cls, path):
+        """Parses the taxonomy of a BIOM file with vectorized string ops."""
+        ids, taxonomy = read_taxonomy(path)
+        codes = np.full(taxonomy.shape, UNASSIGNED, dtype=np.int32)
+        names = {}
+        for i, rank in enumerate(RANKS):
+            # 'g__Akkermansia' -> 'Akkermansia'; unprefixed values are kept as they are
+            column = pd.Series(taxonomy[:, i]).str.strip().str.replace(r'^[a-z]__', '', regex=True)
+            assigned = (column != '').to_numpy()
+            names[rank], codes[assigned, i] = np.unique(column[assigned].to_numpy(dtype=str), return_inverse=True)
+        return cls(ids, codes, names)
+
+    @classmethod
+    def load(cls, path):
+        """The index for a BIOM file, from data/cache/ when the file is unchanged."""
+        cache_path = os.path.join(CACHE_DIR, f'taxonomy_index.{os.path.basename(path)}.npz')
+        previous = None
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                previous = json.loads(str(cached['fingerprint']))
+                if file_fingerprint(path, previous)['hash'] == previous['hash']:
+                    return cls(cached['observation_ids'], cached['codes'],
+                               {rank: cached[f'names_{rank}'] for rank in RANKS})
+
+        index = cls.from_biom(path)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        np.savez(
+            cache_path,
+            fingerprint=json.dumps(file_fingerprint(path, previous)),
+            observation_ids=index.observation_ids,
+            codes=index.codes,
+            **{f'names_{rank}': index.names[rank] for rank in RANKS},
+        )
+        return index
+
+    def assign(self, rank, taxa):
+        """
+        Position in `taxa` (case-insensitive, exact name) of every observation's
+        name at `rank`, or -1 for observations that belong to none of them.
+        """
+        wanted = pd.Index([t.lower() for t in taxa])
+        # Translate the rank's name table once, then index it with the per-observation codes
+        name_to_taxon = wanted.get_indexer(np.char.lower(self.names[rank].astype(str)))
+        column = self.codes[:, RANKS.index(rank)]
+        if not len(name_to_taxon):
+            return np.full(len(column), -1)
+        return np.where(column == UNASSIGNED, -1, name_to_taxon[column])
+
+    def lookup(self, rank, taxa):
+        """Observation indices whose name at `rank` is one of `taxa`."""
+        return np.flatnonzero(self.assign(rank, taxa) >= 0)
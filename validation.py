@@ -0,0 +1,106 @@
+"""
+Declarative data-validation rules for the ETL.
+
+Every rule is evaluated as one vectorized boolean mask over a whole block of
+rows. Rows failing any rule are split off with the names of the rules they
+broke and end up in the `quarantine` table instead of being silently
+coerced to NaN or filtered again in every downstream query.
+
+Rule keys:
+    rule      name recorded as the quarantine reason
+    column    column the rule looks at (rules on absent columns are ignored)
+    matches   regex; the row fails if the value matches  (control samples)
+    pattern   regex; the row fails if the value does NOT match  (ID format)
+    numeric   True; the row fails if a non-missing value is not a number
+    between   (low, high); the row fails if a numeric value is outside the range
+    exclusive True to make `between` exclusive on both ends
+    allowed   list of accepted values for a categorical column
+Missing values (NaN and the survey's 'Unspecified'-style answers) never fail a rule.
+"""
+import numpy as np
+import pandas as pd
+
+# Survey answers that mean "no answer" rather than a bad value
+MISSING_VALUES = [
+    'Unspecified', 'unspecified', 'Unknown', 'unknown', 'no_data',
+    'Not provided', 'not provided', 'Missing: Not provided',
+]
+
+# Extraction/sequencing controls (e.g. 10317.BLANK.8F.r19) are not patients
+CONTROL_PATTERN = r'(?i)\b(?:blank|mock|ntc)\b'
+SAMPLE_ID_PATTERN = r'^\d+\.[A-Za-z0-9.]+$'
+
+SAMPLE_RULES = [
+    {'rule': 'control_sample', 'column': 'sample_id', 'matches': CONTROL_PATTERN},
+    {'rule': 'malformed_sample_id', 'column': 'sample_id', 'pattern': SAMPLE_ID_PATTERN},
+    {'rule': 'age_not_numeric', 'column': 'age', 'numeric': True},
+    {'rule': 'age_out_of_range', 'column': 'age', 'between': (0, 120)},
+    {'rule': 'bmi_not_numeric', 'column': 'bmi', 'numeric': True},
+    # Same bounds the analysis queries used to re-apply (bmi > 0 AND bmi < 60)
+    {'rule': 'bmi_out_of_range', 'column': 'bmi', 'between': (0, 60), 'exclusive': True},
+    {'rule': 'unexpected_sex', 'column': 'sex', 'allowed': ['male', 'female', 'other']},
+    {'rule': 'unexpected_diet_type', 'column': 'diet_type', 'allowed': [
+        'Omnivore', 'Omnivore but do not eat red meat', 'Vegetarian',
+        'Vegetarian but eat seafood', 'Vegan',
+    ]},
+    {'rule': 'unexpected_antibiotic_history', 'column': 'antibiotic_history', 'allowed': [
+        'Week', 'Month', '6 months', 'Year', 'I have not taken antibiotics in the past year.',
+    ]},
+]
+
+LAB_RULES = [
+    {'rule': 'control_sample', 'column': 'sample_id', 'matches': CONTROL_PATTERN},
+    {'rule': 'malformed_sample_id', 'column': 'sample_id', 'pattern': SAMPLE_ID_PATTERN},
+    {'rule': 'negative_shannon_entropy', 'column': 'shannon_entropy', 'between': (0, np.inf)},
+    {'rule': 'negative_phylogenetic_diversity', 'column': 'phylogenetic_diversity', 'between': (0, np.inf)},
+    {'rule': 'negative_species_count', 'column': 'species_count', 'between': (0, np.inf)},
+]
+
+
+def rule_mask(df, rule):
+    """Boolean Series: True where the row fails the rule."""
+    values = df[rule['column']]
+    present = values.notna() & ~values.isin(MISSING_VALUES)
+    text = values.astype(str)
+
+    if 'matches' in rule:
+        return present & text.str.contains(rule['matches'], regex=True)
+    if 'pattern' in rule:
+        return present & ~text.str.match(rule['pattern'])
+    if 'numeric' in rule:
+        return present & pd.to_numeric(values, errors='coerce').isna()
+    if 'between' in rule:
+        low, high = rule['between']
+        numbers = pd.to_numeric(values, errors='coerce')
+        inside = (numbers > low) & (numbers < high) if rule.get('exclusive') else numbers.between(low, high)
+        return numbers.notna() & ~inside
+    if 'allowed' in rule:
+        return present & ~values.isin(rule['allowed'])
+    raise ValueError(f"Rule {rule['rule']!r} has no check")
+
+
+def apply_rules(df, rules, source):
+    """
+    Splits df into (passing rows, quarantine rows). Quarantine rows carry the
+    source, sample_id, the '; '-joined names of every failed rule and the
+    original record as JSON.
+    """
+    rules = [r for r in rules if r['column'] in df.columns]
+    if not rules or df.empty:
+        return df, pd.DataFrame(columns=['source', 'sample_id', 'reason', 'record'])
+
+    fails = np.column_stack([rule_mask(df, r).to_numpy(dtype=bool) for r in rules])
+    bad = fails.any(axis=1)
+
+    # Concatenate the names of the failed rules, row by row, without a Python loop over rows
+    labels = np.array([r['rule'] + '; ' for r in rules], dtype=object)
+    reasons = np.where(fails[bad], labels, '').sum(axis=1)
+
+    rejected = df[bad]
+    quarantine = pd.DataFrame({
+        'source': source,
+        'sample_id': rejected['sample_id'].astype(str).to_numpy(),
+        'reason': pd.Series(reasons, dtype=object).str.rstrip('; ').to_numpy(),
+        'record': rejected.to_json(orient='records', lines=True).splitlines(),
+    })
+    return df[~bad], quarantine